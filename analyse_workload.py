@@ -1,28 +1,327 @@
-experiment_workload = []
-negative_workload = []
-stress_workload = []
-
-with open('workload.txt', 'r') as f:
-    workload_pattern = f.read().split(' ')
-
-    count = 0
-    neg_count = 0
-    stress_count = 0
-    for item in workload_pattern:
-        item = int(item)
-        
-        if item < 20:
-            negative_workload.append(item)
-            neg_count += item
-        else:
-            stress_workload.append(item)
-            stress_count += item
-        
-        experiment_workload.append(item)
-        count += item
-
-print(len(experiment_workload), len(negative_workload), len(stress_workload))
-print(list(map(lambda r: int(r / 2), experiment_workload)))
-print("Experiment workload:{}, exp_count:{}".format(experiment_workload, count))         
-print("Negative:{}, Neg_count:{}, Neg_time:{}".format(negative_workload, neg_count, len(negative_workload)))
-print("Stress:{}, Stress_Count:{}, Stress Time:{}, Avg RPS:{}".format(stress_workload, stress_count, len(stress_workload), stress_count/len(stress_workload)))
\ No newline at end of file
+"""
+Workload trace toolkit for the load tester.
+
+A trace is a whitespace separated list of integers, one entry per second, where each
+entry is the number of requests the load tester sends in that second (see workload.txt).
+This module reads such traces (also very long, day-long ones), computes the statistics we
+use to size the replica limits and the autoscaler parameters, and synthesizes new traces
+in the same format so they can be replayed with load_tester.py.
+
+Usage:
+    python analyse_workload.py stats workload.txt
+    python analyse_workload.py generate workload.txt -o spike.txt --scale 2 --compress 4 --bursts 3
+"""
+
+import argparse
+import json
+
+import numpy as np
+
+
+# Requests/second below this value belong to the "negative" (idle) part of the course workload
+STRESS_THRESHOLD = 20
+
+# Read traces in chunks so day-long traces never have to be held as one big string
+CHUNK_SIZE = 1 << 20
+
+
+def iter_workload_chunks(path, chunk_size=CHUNK_SIZE):
+    """
+    Stream a trace file and yield it as int64 numpy arrays of at most ~chunk_size bytes each.
+    A number that is split across two reads is carried over to the next chunk.
+    """
+    carry = ''
+    with open(path, 'r') as f:
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            block = carry + block
+            # The last token may be cut in half, keep it for the next read
+            cut = max(block.rfind(' '), block.rfind('\n'), block.rfind('\t'))
+            if cut == -1:
+                carry = block
+                continue
+            carry = block[cut + 1:]
+            values = np.array(block[:cut].split(), dtype=np.int64)
+            if values.size:
+                yield values
+    if carry.strip():
+        yield np.array(carry.split(), dtype=np.int64)
+
+
+def load_workload(path, chunk_size=CHUNK_SIZE):
+    """Load a whole trace into one int64 numpy array (requests per second)."""
+    chunks = list(iter_workload_chunks(path, chunk_size))
+    if not chunks:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(chunks)
+
+
+def save_workload(path, workload):
+    """Write a trace in the format consumed by load_tester.py (space separated, no newline)."""
+    workload = np.asarray(workload, dtype=np.int64)
+    with open(path, 'w') as f:
+        f.write(' '.join(map(str, workload.tolist())))
+
+
+def split_workload(workload, threshold=STRESS_THRESHOLD):
+    """Split a trace into the negative (< threshold) and stress (>= threshold) seconds."""
+    workload = np.asarray(workload)
+    stress_mask = workload >= threshold
+    return workload[~stress_mask], workload[stress_mask]
+
+
+def autocorrelation(workload, max_lag=None):
+    """
+    Normalized autocorrelation of the trace for lags 0..max_lag, computed with an FFT so it
+    stays O(n log n) on long traces.
+    """
+    x = np.asarray(workload, dtype=np.float64)
+    n = x.size
+    if n == 0:
+        return np.zeros(0)
+    if max_lag is None:
+        max_lag = n // 2
+    max_lag = min(max_lag, n - 1)
+
+    x = x - x.mean()
+    # Zero pad to avoid circular correlation
+    size = 1 << int(np.ceil(np.log2(2 * n)))
+    spectrum = np.fft.rfft(x, size)
+    acf = np.fft.irfft(spectrum * np.conj(spectrum), size)[:max_lag + 1]
+    if acf[0] == 0:
+        # Constant trace, no variation to correlate
+        return np.zeros(max_lag + 1)
+    return acf / acf[0]
+
+
+def dominant_period(acf, min_lag=2, min_prominence=0.1):
+    """
+    Return the lag (in seconds) of the strongest autocorrelation peak after min_lag together
+    with its correlation value, or (None, 0.0) if the trace has no seasonality.
+
+    A peak only counts if it rises at least min_prominence above the lowest correlation
+    before it, so a slowly decaying (trending) but noisy autocorrelation is not reported
+    as a short period.
+    """
+    if acf.size <= min_lag + 1:
+        return None, 0.0
+    inner = acf[1:-1]
+    peaks = np.flatnonzero((inner > acf[:-2]) & (inner >= acf[2:]) & (inner > 0)) + 1
+    peaks = peaks[peaks >= min_lag]
+    if peaks.size == 0:
+        return None, 0.0
+    troughs = np.minimum.accumulate(acf)
+    peaks = peaks[acf[peaks] - troughs[peaks] >= min_prominence]
+    if peaks.size == 0:
+        return None, 0.0
+    best = peaks[np.argmax(acf[peaks])]
+    return int(best), float(acf[best])
+
+
+def ramp_slopes(workload, window=10):
+    """
+    Least-squares slope (requests/s per second) of every sliding window of the trace,
+    computed for all windows at once with convolutions.
+    """
+    y = np.asarray(workload, dtype=np.float64)
+    if y.size < window or window < 2:
+        return np.zeros(0)
+    t = np.arange(window, dtype=np.float64)
+    t_centered = t - t.mean()
+    # slope = sum((t - t_mean) * y) / sum((t - t_mean)^2); the y mean term vanishes
+    kernel = t_centered[::-1] / np.sum(t_centered ** 2)
+    return np.convolve(y, kernel, mode='valid')
+
+
+def workload_stats(workload, threshold=STRESS_THRESHOLD, slope_window=10, max_lag=None):
+    """Compute the summary statistics of a trace as a plain dict."""
+    workload = np.asarray(workload, dtype=np.int64)
+    if workload.size == 0:
+        raise ValueError("Workload trace is empty")
+
+    rates = workload.astype(np.float64)
+    mean = rates.mean()
+    std = rates.std()
+    p50, p90, p95, p99 = np.percentile(rates, [50, 90, 95, 99])
+    negative, stress = split_workload(workload, threshold)
+
+    acf = autocorrelation(rates, max_lag)
+    period, period_acf = dominant_period(acf)
+
+    slopes = ramp_slopes(rates, slope_window)
+    if slopes.size:
+        steepest_up = float(slopes.max())
+        steepest_down = float(slopes.min())
+    else:
+        steepest_up = steepest_down = 0.0
+
+    return {
+        'duration_seconds': int(workload.size),
+        'total_requests': int(workload.sum()),
+        'mean_rps': float(mean),
+        'std_rps': float(std),
+        'min_rps': int(workload.min()),
+        'max_rps': int(workload.max()),
+        'p50_rps': float(p50),
+        'p90_rps': float(p90),
+        'p95_rps': float(p95),
+        'p99_rps': float(p99),
+        'peak_to_mean': float(workload.max() / mean) if mean else 0.0,
+        # Coefficient of variation and index of dispersion (1.0 for a Poisson process)
+        'cv': float(std / mean) if mean else 0.0,
+        'dispersion_index': float(rates.var() / mean) if mean else 0.0,
+        'acf_lag1': float(acf[1]) if acf.size > 1 else 0.0,
+        'period_seconds': period,
+        'period_acf': period_acf,
+        'slope_window_seconds': slope_window,
+        'steepest_ramp_up': steepest_up,
+        'steepest_ramp_down': steepest_down,
+        'negative_seconds': int(negative.size),
+        'negative_requests': int(negative.sum()),
+        'stress_seconds': int(stress.size),
+        'stress_requests': int(stress.sum()),
+        'stress_avg_rps': float(stress.mean()) if stress.size else 0.0,
+    }
+
+
+def scale_workload(workload, factor):
+    """Multiply every second of the trace by factor (rounded to whole requests)."""
+    scaled = np.rint(np.asarray(workload, dtype=np.float64) * factor)
+    return np.maximum(scaled, 0).astype(np.int64)
+
+
+def compress_workload(workload, factor):
+    """
+    Compress the trace in time by an integer factor: every `factor` seconds are merged into
+    one second carrying all of their requests, so the same load arrives `factor` times faster.
+    """
+    workload = np.asarray(workload, dtype=np.int64)
+    factor = int(factor)
+    if factor <= 1:
+        return workload.copy()
+    pad = (-workload.size) % factor
+    padded = np.concatenate([workload, np.zeros(pad, dtype=np.int64)])
+    return padded.reshape(-1, factor).sum(axis=1)
+
+
+def inject_bursts(workload, count, magnitude=3.0, duration=10, rng=None):
+    """
+    Add `count` bursts at random positions. Each burst multiplies the rate inside its
+    window by `magnitude` (with a sine shaped rise and fall) for `duration` seconds.
+    """
+    workload = np.asarray(workload, dtype=np.int64)
+    if count <= 0 or workload.size == 0:
+        return workload.copy()
+    rng = np.random.default_rng() if rng is None else rng
+    duration = max(1, min(int(duration), workload.size))
+
+    multiplier = np.ones(workload.size, dtype=np.float64)
+    shape = 1 + (magnitude - 1) * np.sin(np.linspace(0, np.pi, duration + 2)[1:-1])
+    starts = rng.integers(0, workload.size - duration + 1, size=count)
+    for start in starts:
+        window = multiplier[start:start + duration]
+        np.maximum(window, shape, out=window)
+
+    # Keep idle seconds from staying at 0 inside a burst
+    base = np.maximum(workload, 1).astype(np.float64)
+    bursty = np.where(multiplier > 1, np.rint(base * multiplier), workload)
+    return bursty.astype(np.int64)
+
+
+def generate_workload(workload, scale=1.0, compress=1, bursts=0, burst_magnitude=3.0,
+                      burst_duration=10, noise=False, seed=None):
+    """
+    Synthesize a new trace from an existing one.
+
+    The trace is scaled, compressed in time and gets bursts injected (in that order).
+    With noise=True every second is resampled from a Poisson distribution around its rate,
+    which gives a new realisation of the same load pattern.
+    """
+    rng = np.random.default_rng(seed)
+    result = scale_workload(workload, scale)
+    result = compress_workload(result, compress)
+    result = inject_bursts(result, bursts, burst_magnitude, burst_duration, rng)
+    if noise:
+        result = rng.poisson(result).astype(np.int64)
+    return result
+
+
+def print_stats(stats):
+    print("Duration: {}s, Total requests: {}".format(stats['duration_seconds'], stats['total_requests']))
+    print("RPS mean: {:.2f}, std: {:.2f}, min: {}, max: {}".format(
+        stats['mean_rps'], stats['std_rps'], stats['min_rps'], stats['max_rps']))
+    print("RPS p50: {:.1f}, p90: {:.1f}, p95: {:.1f}, p99: {:.1f}".format(
+        stats['p50_rps'], stats['p90_rps'], stats['p95_rps'], stats['p99_rps']))
+    print("Peak-to-mean: {:.2f}, CV: {:.2f}, Dispersion index: {:.2f}, ACF(1): {:.2f}".format(
+        stats['peak_to_mean'], stats['cv'], stats['dispersion_index'], stats['acf_lag1']))
+    if stats['period_seconds'] is None:
+        print("Seasonality: none detected")
+    else:
+        print("Seasonality: period {}s (acf {:.2f})".format(stats['period_seconds'], stats['period_acf']))
+    print("Steepest ramp over {}s: up {:.2f} rps/s, down {:.2f} rps/s".format(
+        stats['slope_window_seconds'], stats['steepest_ramp_up'], stats['steepest_ramp_down']))
+    print("Negative: Neg_count:{}, Neg_time:{}".format(stats['negative_requests'], stats['negative_seconds']))
+    print("Stress: Stress_Count:{}, Stress Time:{}, Avg RPS:{:.2f}".format(
+        stats['stress_requests'], stats['stress_seconds'], stats['stress_avg_rps']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse and generate load tester workload traces")
+    subparsers = parser.add_subparsers(dest='command')
+
+    stats_parser = subparsers.add_parser('stats', help="Print statistics of a trace")
+    stats_parser.add_argument('trace', nargs='?', default='workload.txt')
+    stats_parser.add_argument('--threshold', type=int, default=STRESS_THRESHOLD,
+                              help="Requests/s separating negative from stress seconds")
+    stats_parser.add_argument('--slope-window', type=int, default=10,
+                              help="Window in seconds for the ramp slope")
+    stats_parser.add_argument('--max-lag', type=int, default=None,
+                              help="Largest lag in seconds for the autocorrelation")
+    stats_parser.add_argument('--json', action='store_true', help="Print the statistics as JSON")
+
+    generate_parser = subparsers.add_parser('generate', help="Synthesize a new trace from an existing one")
+    generate_parser.add_argument('trace', nargs='?', default='workload.txt')
+    generate_parser.add_argument('-o', '--output', required=True)
+    generate_parser.add_argument('--scale', type=float, default=1.0, help="Multiply every rate by this factor")
+    generate_parser.add_argument('--compress', type=int, default=1, help="Merge this many seconds into one")
+    generate_parser.add_argument('--bursts', type=int, default=0, help="Number of bursts to inject")
+    generate_parser.add_argument('--burst-magnitude', type=float, default=3.0)
+    generate_parser.add_argument('--burst-duration', type=int, default=10)
+    generate_parser.add_argument('--noise', action='store_true', help="Resample every second from a Poisson distribution")
+    generate_parser.add_argument('--seed', type=int, default=None)
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        try:
+            workload = load_workload(args.trace)
+        except ValueError as e:
+            parser.error("{}: {}".format(args.trace, e))
+        generated = generate_workload(workload, scale=args.scale, compress=args.compress,
+                                      bursts=args.bursts, burst_magnitude=args.burst_magnitude,
+                                      burst_duration=args.burst_duration, noise=args.noise,
+                                      seed=args.seed)
+        save_workload(args.output, generated)
+        print("Wrote {} seconds ({} requests) to {}".format(generated.size, int(generated.sum()), args.output))
+        return
+
+    trace = getattr(args, 'trace', 'workload.txt')
+    try:
+        workload = load_workload(trace)
+        stats = workload_stats(workload,
+                               threshold=getattr(args, 'threshold', STRESS_THRESHOLD),
+                               slope_window=getattr(args, 'slope_window', 10),
+                               max_lag=getattr(args, 'max_lag', None))
+    except ValueError as e:
+        # Empty trace or a token that is not an integer
+        parser.error("{}: {}".format(trace, e))
+    if getattr(args, 'json', False):
+        print(json.dumps(stats, indent=2))
+    else:
+        print_stats(stats)
+
+
+if __name__ == "__main__":
+    main()
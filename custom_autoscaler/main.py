@@ -1,6 +1,8 @@
 import asyncio
 import httpx
 import logging
+import os
+from aiohttp import web
 from kubernetes import client, config
 import time
 import math
@@ -10,14 +12,25 @@ logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %
 logger = logging.getLogger(__name__)
 
 # Configuration
-PROMETHEUS_URL = "http://prometheus-operated.monitoring.svc:9090"
-DEPLOYMENT_NAME = "ml-app-deployment"
-NAMESPACE = "default"
-POLL_INTERVAL = 15
-COOLDOWN_SECONDS = 150
-MIN_REPLICAS = 1
-MAX_REPLICAS = 6
-DESIRED_QSIZE = 50
+PROMETHEUS_URL = os.getenv('PROMETHEUS_URL', "http://prometheus-operated.monitoring.svc:9090")
+DEPLOYMENT_NAME = os.getenv('DEPLOYMENT_NAME', "ml-app-deployment")
+NAMESPACE = os.getenv('NAMESPACE', "default")
+DISPATCHER_JOB = os.getenv('DISPATCHER_JOB', "dispatcher-service")
+POLL_INTERVAL = int(os.getenv('POLL_INTERVAL', '15'))
+COOLDOWN_SECONDS = int(os.getenv('COOLDOWN_SECONDS', '150'))
+MIN_REPLICAS = int(os.getenv('MIN_REPLICAS', '1'))
+MAX_REPLICAS = int(os.getenv('MAX_REPLICAS', '6'))
+DESIRED_QSIZE = int(os.getenv('DESIRED_QSIZE', '50'))
+
+# Scale to zero: after SCALE_TO_ZERO_IDLE_SECONDS without requests and with an empty queue the
+# ML app is scaled to 0 replicas. The dispatcher buffers requests meanwhile and calls
+# POST /wake on WAKE_PORT to get replicas started without waiting for the next poll.
+SCALE_TO_ZERO = os.getenv('SCALE_TO_ZERO', 'false').lower() == 'true'
+SCALE_TO_ZERO_IDLE_SECONDS = int(os.getenv('SCALE_TO_ZERO_IDLE_SECONDS', '600'))
+WAKE_PORT = int(os.getenv('WAKE_PORT', '8080'))
+
+# Time of the last scaling action that starts the cooldown
+last_scale_time = 0
 
 async def get_metric(query):
     """Get qsize from Prometheus."""
@@ -41,16 +54,66 @@ async def check_replicas_ready(v1_api):
             label_selector=f"app=ml-app"
         )
         for pod in pods.items:
-            for condition in pod.status.conditions or []:
-                if condition.type == "Ready" and condition.status != "True":
-                    return False
+            # A Pending pod has no Ready condition yet
+            if not any(condition.type == "Ready" and condition.status == "True"
+                       for condition in pod.status.conditions or []):
+                return False
         return True
     except client.exceptions.ApiException as e:
         logger.error(f"Error checking pod readiness: {e}")
         return False
 
-async def scale_deployment(qsize, v1_api):
-    """Scale deployment based on qsize."""
+async def scale_from_zero(apps_v1, qsize=None):
+    """
+    Scale up right away if the deployment is at zero, sized for the waiting requests.
+    This does not start the cooldown, so the regular loop can keep adjusting the replicas
+    as soon as the new pods are ready. Returns the new number of replicas, None if the
+    deployment was not at zero.
+    """
+    try:
+        deployment = apps_v1.read_namespaced_deployment(DEPLOYMENT_NAME, NAMESPACE)
+        if deployment.spec.replicas != 0:
+            return None
+        desired_replicas = min(MAX_REPLICAS, max(1, math.ceil((qsize or 0) / DESIRED_QSIZE)))
+        apps_v1.patch_namespaced_deployment_scale(
+            name=DEPLOYMENT_NAME,
+            namespace=NAMESPACE,
+            body={"spec": {"replicas": desired_replicas}}
+        )
+        logging.getLogger().setLevel(logging.INFO)
+        logger.info(f"Scaled {DEPLOYMENT_NAME} from 0 to {desired_replicas} replicas")
+        logging.getLogger().setLevel(logging.ERROR)
+        return desired_replicas
+    except client.exceptions.ApiException as e:
+        logger.error(f"Error scaling from zero: {e}")
+        return None
+
+def make_wake_handler(apps_v1):
+    async def handle_wake(request):
+        """
+        Wake-up signal from the dispatcher: requests are buffered while the ML app is at zero.
+        Responds with the new number of replicas, null if the ML app was not at zero.
+        """
+        qsize = None
+        if request.can_read_body:
+            try:
+                qsize = (await request.json()).get('queue_size')
+            except ValueError:
+                pass
+        replicas = await scale_from_zero(apps_v1, qsize)
+        return web.json_response({'replicas': replicas})
+    return handle_wake
+
+async def start_wake_server(apps_v1, port=WAKE_PORT):
+    app = web.Application()
+    app.router.add_post('/wake', make_wake_handler(apps_v1))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    return runner
+
+async def scale_deployment(qsize, apps_v1, v1_api, min_replicas=MIN_REPLICAS):
+    """Scale deployment based on qsize. min_replicas is 0 once the ML app may scale to zero."""
     global last_scale_time
     if time.time() - last_scale_time < COOLDOWN_SECONDS:
         logger.info("Skipping scaling due to cooldown period")
@@ -68,19 +131,20 @@ async def scale_deployment(qsize, v1_api):
         logger.error(f"Error getting replicas: {e}")
         current_replicas = 1
 
+    # Scaling up from zero with a non-empty queue is done by scale_from_zero
     desired_replicas = current_replicas
     if qsize is not None:
         if qsize == 0:
             # Explicitly scale to MIN_REPLICAS when queue is empty
-            desired_replicas = MIN_REPLICAS
+            desired_replicas = min_replicas
         elif qsize > DESIRED_QSIZE:
             # Scale up for high queue sizes
             desired_replicas = math.ceil(current_replicas * (qsize / DESIRED_QSIZE))
         elif qsize <= DESIRED_QSIZE:
             # Gradual downscaling for low queue sizes
-            desired_replicas = max(MIN_REPLICAS, math.ceil(current_replicas * (qsize / DESIRED_QSIZE)))
+            desired_replicas = max(min_replicas, math.ceil(current_replicas * (qsize / DESIRED_QSIZE)))
         # Ensure replicas stay within bounds
-        desired_replicas = max(MIN_REPLICAS, min(MAX_REPLICAS, desired_replicas))
+        desired_replicas = max(min_replicas, min(MAX_REPLICAS, desired_replicas))
 
     if desired_replicas != current_replicas:
         try:
@@ -99,10 +163,27 @@ async def scale_deployment(qsize, v1_api):
         logging.getLogger().setLevel(logging.INFO)
         logger.info("No scaling action taken")
         logging.getLogger().setLevel(logging.ERROR)
-async def main():
+async def main(apps_v1, v1_api):
     """Run autoscaler."""
-    qsize = await get_metric('dispatcher_queue_size{job="dispatcher-service", namespace="default"}')
-    await scale_deployment(qsize, v1_api)
+    # With the shared (redis) queue every dispatcher replica reports the global queue depth,
+    # so aggregate over replicas instead of reading whichever series comes first
+    selector = f'job="{DISPATCHER_JOB}", namespace="{NAMESPACE}"'
+    qsize = await get_metric(f'max(dispatcher_queue_size{{{selector}}})')
+    min_replicas = MIN_REPLICAS
+    if SCALE_TO_ZERO:
+        # Requests the dispatchers' workers took from the queue are not in qsize, e.g. the ones
+        # buffered while the ML app scales up from zero
+        inflight = await get_metric(f'sum(dispatcher_inflight_requests{{{selector}}})')
+        waiting = (qsize or 0) + (inflight or 0)
+        # Requests waiting while at zero (e.g. a missed wake-up signal)
+        if waiting and await scale_from_zero(apps_v1, waiting):
+            # The regular scaling takes over on the next polls, once the new pods are ready
+            return
+        last_request = await get_metric(f'max(dispatcher_last_request_timestamp_seconds{{{selector}}})')
+        if (qsize == 0 and inflight == 0 and last_request is not None
+                and time.time() - last_request >= SCALE_TO_ZERO_IDLE_SECONDS):
+            min_replicas = 0
+    await scale_deployment(qsize, apps_v1, v1_api, min_replicas)
 
 if __name__ == "__main__":
     logger.info("Entering infinite loop")
@@ -113,13 +194,15 @@ if __name__ == "__main__":
         config.load_kube_config()
     apps_v1 = client.AppsV1Api()
     v1_api = client.CoreV1Api()
-    last_scale_time = 0
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
+    if SCALE_TO_ZERO:
+        # Serves the wake-up endpoint while the loop runs (also during the sleeps below)
+        wake_server = loop.run_until_complete(start_wake_server(apps_v1))
     while True:
         try:
-            loop.run_until_complete(main())
+            loop.run_until_complete(main(apps_v1, v1_api))
         except Exception as e:
             logger.error(f"Error in main loop: {e}")
-        logger.info(f"Sleeping for 15 seconds at {loop.time()}")
-        loop.run_until_complete(asyncio.sleep(15))
\ No newline at end of file
+        logger.info(f"Sleeping for {POLL_INTERVAL} seconds at {loop.time()}")
+        loop.run_until_complete(asyncio.sleep(POLL_INTERVAL))
@@ -1,36 +1,157 @@
 import asyncio
 import io
+import lzma
+import os
+import tarfile
+import zipfile
+import zlib
 
 from fastapi import FastAPI, UploadFile
 from PIL import Image
 
+from queue_backend import Job, PRIORITY_INTERACTIVE, create_backend
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# What a truncated or corrupt archive raises while it is read (bad CRC, broken compressed
+# stream, missing data, unsupported compression method)
+ARCHIVE_ERRORS = (zipfile.BadZipFile, tarfile.TarError, zlib.error, lzma.LZMAError, EOFError, OSError,
+                  NotImplementedError)
+
+
+class BulkLimitError(ValueError):
+    pass
+
+
+class BulkArchiveError(ValueError):
+    pass
+
+
+def extract_images(filename, fileobj, max_images, max_image_bytes, max_total_bytes):
+    """
+    Returns a list of (filename, image bytes) for an upload of the bulk endpoint.
+    zip and tar (also compressed) archives are unpacked, anything else is treated as one image.
+
+    Oversized uploads (e.g. zip bombs) are rejected with BulkLimitError: a zip's index is
+    checked before any member is read. A tar has no index, its members are checked while the
+    archive is read, which stops at the first member over the limits (a compressed tar is
+    decompressed up to that point). Corrupt archives raise BulkArchiveError.
+    """
+    try:
+        return _extract_images(filename, fileobj, max_images, max_image_bytes, max_total_bytes)
+    except ARCHIVE_ERRORS as e:
+        raise BulkArchiveError(f"{filename} is not a valid archive: {e}") from e
+
+
+def _extract_images(filename, fileobj, max_images, max_image_bytes, max_total_bytes):
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            members = [info for info in archive.infolist()
+                       if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)]
+            # file_size also bounds how much ZipFile.read decompresses
+            check_bulk_limits([(info.filename, info.file_size) for info in members],
+                              max_images, max_image_bytes, max_total_bytes)
+            return [(info.filename, archive.read(info)) for info in members]
+    fileobj.seek(0)
+    if tarfile.is_tarfile(fileobj):
+        fileobj.seek(0)
+        with tarfile.open(fileobj=fileobj) as archive:
+            members = []
+
+            def index():
+                # Iterating reads the archive one member header at a time
+                for member in archive:
+                    if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                        members.append(member)
+                        yield member.name, member.size
+
+            check_bulk_limits(index(), max_images, max_image_bytes, max_total_bytes)
+            return [(member.name, archive.extractfile(member).read()) for member in members]
+    fileobj.seek(0)
+    data = fileobj.read(max_image_bytes + 1)
+    name = os.path.basename(filename or 'image')
+    check_bulk_limits([(name, len(data))], max_images, max_image_bytes, max_total_bytes)
+    return [(name, data)]
+
+
+def check_bulk_limits(members, max_images, max_image_bytes, max_total_bytes):
+    """
+    members is an iterable of (filename, uncompressed size), checked as it is consumed so a
+    lazily read archive is not read past the limits. Raises BulkLimitError.
+    """
+    count = 0
+    total = 0
+    for name, size in members:
+        count += 1
+        if count > max_images:
+            raise BulkLimitError(f"Too many images, at most {max_images} left for this request")
+        if size > max_image_bytes:
+            raise BulkLimitError(f"{name} is larger than {max_image_bytes} bytes")
+        total += size
+        if total > max_total_bytes:
+            raise BulkLimitError(f"Images are larger than {max_total_bytes} bytes in total")
+
+
 class Dispatcher:
-    def __init__(self):
-        
-        # This queue is going to hold inference requests:
-        self.request_queue = asyncio.Queue()
+    def __init__(self, backend=None):
+
+        # The backend holds the inference requests (local asyncio queue or shared Redis queue):
+        self.backend = backend or create_backend()
         self.request = None
 
 
-    
-    async def qsize(self) -> int:
-        "Returns the size of the queue as an int"
-        return self.request_queue.qsize()
 
+    async def qsize(self, priority=None) -> int:
+        "Returns the size of the queue as an int (the global size for a shared backend), optionally of one priority"
+        return await self.backend.qsize(priority)
 
-    async def add_to_queue(self, request, request_id) -> asyncio.queues.Queue:
+
+    async def add_to_queue(self, request, request_id, priority=PRIORITY_INTERACTIVE, deadline=None) -> Job:
         """
         This function receives requests from the load balancer and puts them in a queue using asyncio.
-        
-        1. Load tester will send 'workload/sec' (workload = number of requests) 
+
+        1. Load tester will send 'workload/sec' (workload = number of requests)
         2. I need to see how these requests are actually sent and then store them in the asyncio Queue.
         """
 
         image_bytes = await request.read() # The reqeuest is basically the image sent by the load tester.
-        image = Image.open(io.BytesIO(image_bytes))
-        await self.request_queue.put((image, request_id)) # Store tuple instead of just image
-        return self.request_queue
+        return await self.add_bytes_to_queue(image_bytes, request_id, request.content_type, priority, deadline)
+
+    async def add_bytes_to_queue(self, image_bytes, request_id, content_type=None,
+                                 priority=PRIORITY_INTERACTIVE, deadline=None) -> Job:
+        # Only parses the header, so broken uploads are rejected here without decoding the image
+        Image.open(io.BytesIO(image_bytes))
+        job = Job(request_id, image_bytes, content_type or 'image/jpeg', priority=priority, deadline=deadline)
+        await self.backend.put(job)
+        return job
+
+    async def start(self):
+        await self.backend.start()
+
+    async def get_request(self) -> Job:
+        return await self.backend.get()
+
+    async def ack(self, job: Job):
+        "Marks a job as finished once its result is stored, so it is not delivered again"
+        await self.backend.ack(job)
+
+    async def set_result(self, request_id, result: dict):
+        await self.backend.set_result(request_id, result)
+
+    async def wait_result(self, request_id, timeout) -> dict:
+        return await self.backend.wait_result(request_id, timeout)
+
+    async def get_result(self, request_id, timeout=0):
+        "Returns the result dict without consuming it, None if not ready, KeyError if unknown"
+        return await self.backend.get_result(request_id, timeout)
+
+    async def get_results(self, request_ids) -> dict:
+        "Non-blocking lookup of many results in one call, None for the ones not ready yet"
+        return await self.backend.get_results(request_ids)
+
+    async def close(self):
+        await self.backend.close()
 
     async def round_robin(self):
-        
-        pass
\ No newline at end of file
+
+        pass
@@ -6,14 +6,17 @@ import time
 import httpx
 import psutil
 import logging
+import json
+import mimetypes
 
 from aiohttp import ClientSession, TCPConnector
 from prometheus_client import Counter, Gauge, Histogram
 from prometheus_client.exposition import start_http_server
-from io import BytesIO
-from fastapi import FastAPI, UploadFile, Request
-from PIL import Image
-from dispatcher import Dispatcher
+from typing import List
+from fastapi import FastAPI, UploadFile, Request, File, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from dispatcher import Dispatcher, BulkArchiveError, BulkLimitError, extract_images
+from queue_backend import PRIORITY_INTERACTIVE, PRIORITY_BATCH
 
 
 dispatcher = Dispatcher()
@@ -22,26 +25,63 @@ app = FastAPI()
 # Define metrics
 REQUEST_COUNT = Counter('dispatcher_requests', 'Total HTTP requests', ['method', 'endpoint', 'status'])
 QUEUE_SIZE = Gauge('dispatcher_queue_size', 'Number of tasks in the ML inference queue')
+BATCH_QUEUE_SIZE = Gauge('dispatcher_batch_queue_size', 'Number of batch jobs (/jobs, /bulk) in the ML inference queue')
 CPU_USAGE = Gauge('dispatcher_cpu_usage_percent', 'CPU usage percentage')
 MEMORY_USAGE = Gauge('dispatcher_memory_usage_percent', 'Memory usage percentage')
 RESPONSE_TIME = Histogram('dispatcher_response_time_seconds', 'Request response time in seconds', ['endpoint'])
+JOBS_SUBMITTED = Counter('dispatcher_jobs_submitted', 'Asynchronous jobs submitted', ['endpoint'])
+LAST_REQUEST_TIME = Gauge('dispatcher_last_request_timestamp_seconds', 'Unix time of the last inference request received')
+INFLIGHT_REQUESTS = Gauge('dispatcher_inflight_requests', 'Requests taken from the queue by a worker and not finished yet')
+ML_BACKEND_AVAILABLE = Gauge('dispatcher_ml_backend_available', '1 if the ML app accepts connections, 0 while it scales up from zero')
+COLD_START_WAIT = Histogram('dispatcher_cold_start_wait_seconds', 'Time a request was buffered while the ML app scaled up from zero',
+                            buckets=(1, 2.5, 5, 10, 15, 20, 30, 45, 60, 90, 120))
 
 
 # READ FROM ENVIRONMENT VARIABLE INSTEAD OF HARDCODING
 ML_SERVICE_URL = os.getenv('ML_SERVICE_URL', 'http://127.0.0.1:8000')
 ML_API_ENDPOINT = f"{ML_SERVICE_URL}/predict"
+# Server-side latency objective of interactive requests; the time left of it is sent with
+# every request so the ML app can fall back to a faster model variant (see ml_app/model_cascade.py).
+# Batch jobs have no deadline and are only taken when no interactive request is waiting.
+REQUEST_SLO_SECONDS = float(os.getenv('REQUEST_SLO_SECONDS', '0.5'))
+
+# Asynchronous job API
+MAX_LONG_POLL_SECONDS = 30  # Longest wait a client may ask for on GET /jobs/{job_id}
+SSE_KEEPALIVE_SECONDS = 15  # Comment line sent on idle event streams so proxies keep them open
+# Bulk streams stop waiting for images without a result after this long; the jobs stay
+# queued and can still be fetched with GET /jobs/{job_id}
+BULK_RESULT_TIMEOUT = int(os.getenv('BULK_RESULT_TIMEOUT_SECONDS', '3600'))
+BULK_POLL_INTERVAL = 0.5    # Bulk streams look up the results of all their pending jobs this often
+MAX_BULK_IMAGES = int(os.getenv('MAX_BULK_IMAGES', '1000'))
+MAX_IMAGE_BYTES = int(os.getenv('MAX_IMAGE_BYTES', str(10 * 1024 * 1024)))
+MAX_BULK_BYTES = int(os.getenv('MAX_BULK_BYTES', str(256 * 1024 * 1024)))
+
+# Scale to zero: while the ML app has no ready replica, requests stay buffered in the dispatcher
+# and the autoscaler is told to scale up right away instead of on its next poll
+SCALE_TO_ZERO = os.getenv('SCALE_TO_ZERO', 'false').lower() == 'true'
+AUTOSCALER_URL = os.getenv('AUTOSCALER_URL', 'http://autoscaler-service:8080')
+COLD_START_TIMEOUT = 120          # Buffered requests fail after waiting this long for the ML app
+COLD_START_PROBE_INTERVAL = 0.5   # How often the ML app is probed while it is unavailable
+WAKE_SIGNAL_INTERVAL = 5          # Repeat the wake-up signal this often until the ML app is up
 
 # Shared HTTP client for connection pooling
 HTTP_CLIENT = None
 
 # Start Prometheus metrics server
-start_http_server(9000)  # Exposes metrics at http://localhost:9000
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9000'))
+start_http_server(METRICS_PORT)  # Exposes metrics at http://localhost:9000
 
-# NEW: Add request mapping for producer-consumer
-pending_requests = {}  # Maps request_id -> asyncio.Future
-pending_requests_lock = asyncio.Lock()  # Prevent race conditions
+# Pending requests and their results live in the queue backend (see queue_backend.py)
 workers_running = False
 
+# Set while the ML app accepts connections, cleared while it scales up from zero
+ml_backend_ready = asyncio.Event()
+ml_backend_ready.set()
+ML_BACKEND_AVAILABLE.set(1)
+cold_start_task = None
+# Dispatcher startup counts as activity, the autoscaler must not see it as idle right away
+LAST_REQUEST_TIME.set_to_current_time()
+
 @app.on_event("startup")
 async def startup_event():
     """Start background consumer workers"""
@@ -54,6 +94,8 @@ async def startup_event():
         limits=httpx.Limits(max_connections=20, max_keepalive_connections=0)
     )
     
+    await dispatcher.start()
+
     # Start 2 background workers that will call your get_inference function
     asyncio.create_task(consumer_worker(worker_id=1))
     asyncio.create_task(consumer_worker(worker_id=2))
@@ -75,6 +117,7 @@ async def shutdown_event():
     workers_running = False
     if HTTP_CLIENT:
         await HTTP_CLIENT.aclose()
+    await dispatcher.close()
 
 # Background task to update system metrics
 logging.basicConfig(level=logging.INFO)
@@ -86,9 +129,11 @@ async def update_system_metrics():
             cpu_percent = psutil.cpu_percent(interval=.1)
             memory_percent = psutil.virtual_memory().percent
             queue_size = await dispatcher.qsize()
+            batch_queue_size = await dispatcher.qsize(PRIORITY_BATCH)
             CPU_USAGE.set(cpu_percent)
             MEMORY_USAGE.set(memory_percent)
             QUEUE_SIZE.set(queue_size)
+            BATCH_QUEUE_SIZE.set(batch_queue_size)
             logger.info(f"CPU: {cpu_percent}%, Memory: {memory_percent}%, Queue: {queue_size}")
         except Exception as e:
             logger.error(f"Error in update_system_metrics: {e}")
@@ -99,6 +144,9 @@ async def add_metrics(request: Request, call_next):
     method = request.method
     endpoint = request.url.path
     start_time = time.time()
+    if method == 'POST':
+        # Set on arrival, a buffered request may take minutes to complete
+        LAST_REQUEST_TIME.set_to_current_time()
     
     response = await call_next(request)
     
@@ -117,28 +165,34 @@ async def consumer_worker(worker_id: int):
     print(f"Worker {worker_id} started")
     
     while workers_running:
+        try:
+            # Take the next request from the (possibly shared) queue
+            job = await dispatcher.get_request()
+        except Exception as e:
+            print(f"Worker {worker_id} error reading queue: {e}")
+            await asyncio.sleep(1)
+            continue
+
+        INFLIGHT_REQUESTS.inc()
         try:
             # Call your existing get_inference function
-            result, request_id = await get_inference()  # Now returns (result, request_id)
+            result = await get_inference(job)
             print(f"Worker {worker_id} got result: {result}")
-            
-            # Find the correct pending request and give it this result (thread-safe)
-            async with pending_requests_lock:
-                future = pending_requests.pop(request_id, None)
-                
-                if future and not future.done():
-                    future.set_result(result)
-                    print(f"Worker {worker_id} delivered result to request {request_id[:8]}")
-            
+            # Hand the result to whichever replica is waiting for this request
+            await dispatcher.set_result(job.request_id, {'prediction': result})
+            await dispatcher.ack(job)
+            print(f"Worker {worker_id} delivered result to request {job.request_id[:8]}")
         except Exception as e:
             print(f"Worker {worker_id} error: {e}")
-            # If there's an error, still try to resolve a pending request
-            async with pending_requests_lock:
-                if pending_requests:
-                    request_id = next(iter(pending_requests))
-                    future = pending_requests.pop(request_id)
-                    if not future.done():
-                        future.set_exception(e)
+            try:
+                await dispatcher.set_result(job.request_id, {'error': str(e)})
+                await dispatcher.ack(job)
+            except Exception as e:
+                # Queue backend unavailable, the job stays unacknowledged
+                print(f"Worker {worker_id} error delivering error result: {e}")
+                await asyncio.sleep(1)
+        finally:
+            INFLIGHT_REQUESTS.dec()
         
         # Small delay to prevent busy loop
         await asyncio.sleep(0.1)
@@ -159,48 +213,210 @@ async def request_queue(image: UploadFile):
     request_id = str(uuid.uuid4())
     
     # Your original code (minimal change):
-    await dispatcher.add_to_queue(image, request_id)  # Pass request_id for correlation
+    await dispatcher.add_to_queue(image, request_id, deadline=REQUEST_SLO_SECONDS)  # Pass request_id for correlation
     queue_size = await dispatcher.qsize()  # this is not being used but a good stat.
     print("ml service url:{}".format(ML_SERVICE_URL))
     print("ml api endpoint:{}".format(ML_API_ENDPOINT))
     print(f"This is the qsize:{queue_size}")
     # return {'queue_size': queue_size}
     # NEW: Instead of calling get_inference() directly, wait for worker to process it
-    future = asyncio.Future()
-    async with pending_requests_lock:  # Thread-safe access
-        pending_requests[request_id] = future
-    
     try:
-        # Wait for background worker to process your request
-        predictions = await asyncio.wait_for(future, timeout=60)  # Increased from 5 to 70
-        print(f"Request {request_id[:8]} got result: {predictions}")
-        return {'prediction': predictions, 'queue_size': queue_size}
+        # Wait for background worker (of any dispatcher replica) to process your request
+        result = await dispatcher.wait_result(request_id, timeout=60)  # Increased from 5 to 70
+        print(f"Request {request_id[:8]} got result: {result}")
+        return {**result, 'queue_size': queue_size}
         
     except asyncio.TimeoutError:
-        # Clean up on timeout
-        async with pending_requests_lock:  # Thread-safe cleanup
-            pending_requests.pop(request_id, None)
         return {'error': 'Request timeout', 'queue_size': queue_size}
 
-async def get_inference():
+#================================ASYNC JOB API===========================================
+def job_status(job_id, result):
+    if result is None:
+        return {'job_id': job_id, 'status': 'pending'}
+    status = 'error' if 'error' in result else 'done'
+    return {'job_id': job_id, 'status': status, **result}
+
+@app.post("/jobs", status_code=202)
+async def submit_job(image: UploadFile):
+    """
+    Queue one image and return its job id immediately instead of holding the connection.
+    Poll, long-poll or stream the result with GET /jobs/{job_id} or /jobs/{job_id}/events.
+    Jobs have batch priority: they are processed when no interactive request is waiting.
+    """
+    job_id = str(uuid.uuid4())
+    await dispatcher.add_to_queue(image, job_id, priority=PRIORITY_BATCH)
+    JOBS_SUBMITTED.labels(endpoint='/jobs').inc()
+    return {'job_id': job_id, 'status': 'pending', 'queue_size': await dispatcher.qsize()}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """Job status and result. With wait > 0 this long-polls for up to `wait` seconds."""
+    try:
+        result = await dispatcher.get_result(job_id, timeout=min(max(wait, 0), MAX_LONG_POLL_SECONDS))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job_status(job_id, result)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events stream that sends the result of the job once it is ready."""
+    try:
+        result = await dispatcher.get_result(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+
+    async def events(result):
+        while result is None:
+            yield ": keepalive\n\n"
+            try:
+                result = await dispatcher.get_result(job_id, timeout=SSE_KEEPALIVE_SECONDS)
+            except KeyError:
+                # Expired before it finished
+                result = {'error': 'Job expired'}
+        status = job_status(job_id, result)
+        yield f"event: {status['status']}\ndata: {json.dumps(status)}\n\n"
+
+    return StreamingResponse(events(result), media_type="text/event-stream",
+                             headers={'Cache-Control': 'no-cache'})
+
+@app.post("/bulk")
+async def bulk(images: List[UploadFile] = File(...), stream: bool = True):
+    """
+    Queue many images at once, as multiple files and/or zip/tar archives of images.
+
+    With stream=true (default) the results are streamed back as newline delimited JSON in
+    the order they complete. With stream=false only the job ids are returned, to be
+    fetched later with GET /jobs/{job_id}. Like /jobs, these have batch priority.
+    """
+    uploads = []
+    total_bytes = 0
+    for upload in images:
+        try:
+            extracted = extract_images(upload.filename, upload.file, MAX_BULK_IMAGES - len(uploads),
+                                       MAX_IMAGE_BYTES, MAX_BULK_BYTES - total_bytes)
+        except BulkLimitError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except BulkArchiveError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        uploads.extend(extracted)
+        total_bytes += sum(len(image_bytes) for _, image_bytes in extracted)
+
+    jobs = []
+    rejected = []
+    for filename, image_bytes in uploads:
+        job_id = str(uuid.uuid4())
+        try:
+            await dispatcher.add_bytes_to_queue(image_bytes, job_id, mimetypes.guess_type(filename)[0],
+                                                priority=PRIORITY_BATCH)
+            jobs.append((job_id, filename))
+        except Exception as e:
+            rejected.append({'filename': filename, 'status': 'error', 'error': f"Invalid image: {e}"})
+    JOBS_SUBMITTED.labels(endpoint='/bulk').inc(len(jobs))
+
+    if not stream:
+        return JSONResponse({
+            'jobs': [{'job_id': job_id, 'filename': filename, 'status': 'pending'} for job_id, filename in jobs],
+            'rejected': rejected,
+            'queue_size': await dispatcher.qsize(),
+        }, status_code=202)
+
+    async def results():
+        for item in rejected:
+            yield json.dumps(item) + "\n"
+        # One poller looks up all pending jobs per round (a single Redis round trip)
+        pending = dict(jobs)
+        deadline = time.time() + BULK_RESULT_TIMEOUT
+        while pending and time.time() < deadline:
+            for job_id, result in (await dispatcher.get_results(list(pending))).items():
+                if result is not None:
+                    yield json.dumps({'filename': pending.pop(job_id), **job_status(job_id, result)}) + "\n"
+            if pending:
+                await asyncio.sleep(BULK_POLL_INTERVAL)
+        for job_id, filename in pending.items():
+            yield json.dumps({'filename': filename, **job_status(job_id, None)}) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+#================================SCALE TO ZERO===========================================
+async def signal_autoscaler():
+    """Ask the autoscaler to scale the ML app up from zero now."""
+    try:
+        # The queue size lets the autoscaler start enough replicas for the buffered requests
+        response = await HTTP_CLIENT.post(f"{AUTOSCALER_URL}/wake", json={'queue_size': await dispatcher.qsize()}, timeout=2)
+        logger.info(f"Woke autoscaler: {response.status_code}")
+    except httpx.HTTPError as e:
+        logger.error(f"Error waking autoscaler: {e}")
+
+async def probe_ml_backend():
+    """Runs while the ML app is unreachable: wakes the autoscaler and probes until a replica is up."""
+    start_time = time.time()
+    last_signal = 0
+    while True:
+        try:
+            if time.time() - last_signal >= WAKE_SIGNAL_INTERVAL:
+                last_signal = time.time()
+                await signal_autoscaler()
+            await HTTP_CLIENT.get(f"{ML_SERVICE_URL}/", timeout=2)
+            break
+        except httpx.TransportError:
+            await asyncio.sleep(COLD_START_PROBE_INTERVAL)
+        except Exception as e:
+            # e.g. the queue backend failing in signal_autoscaler, the probe must keep running
+            logger.error(f"Error probing ML app: {e}")
+            await asyncio.sleep(1)
+    ML_BACKEND_AVAILABLE.set(1)
+    ml_backend_ready.set()
+    logger.info(f"ML app available after {time.time() - start_time:.1f}s")
+
+def mark_ml_backend_unavailable():
+    global cold_start_task
+    ml_backend_ready.clear()
+    ML_BACKEND_AVAILABLE.set(0)
+    # Also restarts a probe that died, otherwise buffered requests would wait for nothing
+    if cold_start_task is None or cold_start_task.done():
+        cold_start_task = asyncio.create_task(probe_ml_backend())
+
+async def get_inference(job):
     """
     CONSUMER: Your original function, now called by background workers
-    - get request item from queue
-    - post request item to the /predict endpoint  
+    - post request item (taken from the queue by the worker) to the /predict endpoint  
     - get result = {prediction:class + confidence}
     """
-    request_queue = dispatcher.request_queue
-    queue_item, request_id = await request_queue.get()  # Now get tuple (image, request_id)
-    # print(queue_item)
-    
-    # Convert PIL to bytes
-    img_buffer = BytesIO()
-    queue_item.save(img_buffer, format='JPEG')
-    files = {"image": ("image.jpg", img_buffer.getvalue(), "image/jpeg")}
-    img_buffer.close()
-    
-    # Use shared HTTP client with timeout
-    response = await HTTP_CLIENT.post(url=ML_API_ENDPOINT, files=files)
+    # The original upload is forwarded as is, no decode/re-encode in the dispatcher
+    files = {"image": ("image.jpg", job.image_bytes, job.content_type)}
+
+    cold_start_wait = 0
+    while True:
+        if not ml_backend_ready.is_set():
+            # Scaled to zero: keep the request buffered until a replica is up
+            wait_start = time.time()
+            timeout = COLD_START_TIMEOUT - (wait_start - job.enqueued_at)
+            try:
+                await asyncio.wait_for(ml_backend_ready.wait(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:
+                raise RuntimeError("ML app did not scale up from zero in time")
+            finally:
+                cold_start_wait += time.time() - wait_start
+
+        # Load signals for the ML app's model cascade. Batch jobs are taken only when no
+        # interactive request waits, so the interactive depth is what matters for latency.
+        data = {"queue_size": str(await dispatcher.qsize(PRIORITY_INTERACTIVE))}
+        remaining = job.remaining_deadline()
+        if remaining is not None:
+            data["deadline"] = str(remaining)
+
+        try:
+            # Use shared HTTP client with timeout
+            response = await HTTP_CLIENT.post(url=ML_API_ENDPOINT, files=files, data=data)
+            break
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            # No ready ML replica behind the service
+            if not SCALE_TO_ZERO:
+                raise
+            mark_ml_backend_unavailable()
+
+    if cold_start_wait:
+        COLD_START_WAIT.observe(cold_start_wait)
     
     print(response.json()['prediction'])
-    return response.json()['prediction'], request_id  # Return both result and request_id
\ No newline at end of file
+    return response.json()['prediction']
@@ -0,0 +1,389 @@
+"""
+Queue backends for the dispatcher.
+
+A backend holds the inference jobs waiting for a worker and hands the results back to the
+request that is waiting for them. Two backends are available (QUEUE_BACKEND env variable):
+
+    local  - in-process asyncio queue (default). Only one dispatcher replica can use it.
+    redis  - shared Redis list. Any number of dispatcher replicas push jobs to and pull jobs
+             from the same queue, so the work is shared and every replica sees the global
+             queue depth. Results are handed back through a per-request Redis list, so the
+             replica holding the client connection does not have to be the one that ran it.
+             A job a worker takes is moved to that replica's processing list and only removed
+             once its result is stored (ack). Every replica keeps a heartbeat key alive; jobs
+             in the processing list of a replica whose heartbeat expired are put back on the
+             queue, so a job is delivered at least once even if a replica dies mid-job.
+
+Every job has a priority: interactive requests (/add_to_queue) are always taken before batch
+jobs (/jobs, /bulk), so offline work only uses capacity interactive traffic leaves free.
+
+Results can be consumed once by the waiting request (wait_result) or looked up any number of
+times until they expire (get_result), which the asynchronous job API uses for polling.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import socket
+import time
+
+
+QUEUE_BACKEND = os.getenv('QUEUE_BACKEND', 'local')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://redis-service:6379/0')
+REDIS_KEY_PREFIX = os.getenv('REDIS_KEY_PREFIX', 'dispatcher')
+# Results nobody picked up are dropped this many seconds after the job finished. Queued jobs
+# do not expire, batch jobs may wait behind interactive traffic for much longer than this.
+JOB_TTL = int(os.getenv('JOB_TTL_SECONDS', '300'))
+# Pod name, unique per dispatcher replica and kept across container restarts
+REPLICA_ID = os.getenv('HOSTNAME') or socket.gethostname()
+HEARTBEAT_INTERVAL = 5
+# Batch jobs are only checked between waits for interactive requests, at most this long
+BATCH_POLL_INTERVAL = 1
+HEARTBEAT_TTL = 15
+REAP_INTERVAL = 10
+
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH)
+
+
+class Job:
+    def __init__(self, request_id, image_bytes, content_type='image/jpeg', enqueued_at=None,
+                 priority=PRIORITY_INTERACTIVE, deadline=None):
+        self.request_id = request_id
+        self.image_bytes = image_bytes
+        self.content_type = content_type
+        self.enqueued_at = time.time() if enqueued_at is None else enqueued_at
+        self.priority = priority
+        # Latency budget in seconds from enqueue time, None for jobs without a deadline
+        self.deadline = deadline
+        # Queue entry as stored by the backend, needed to acknowledge the job
+        self.raw = None
+
+    def meta(self):
+        return {'request_id': self.request_id, 'content_type': self.content_type, 'enqueued_at': self.enqueued_at,
+                'priority': self.priority, 'deadline': self.deadline}
+
+    def remaining_deadline(self):
+        """Seconds left of the deadline, None if the job has none."""
+        if self.deadline is None:
+            return None
+        return self.deadline - (time.time() - self.enqueued_at)
+
+
+class LocalQueueBackend:
+    """In-process queue, also the stand-in for the shared backend when testing locally."""
+
+    def __init__(self):
+        # Ordered by (priority, arrival), so interactive requests are taken before batch jobs
+        self.request_queue = asyncio.PriorityQueue()
+        self.sequence = itertools.count()
+        self.sizes = {priority: 0 for priority in PRIORITIES}
+        # Maps request_id -> asyncio.Future for the result
+        self.pending_requests = {}
+        # Maps request_id -> time its result was set, oldest first
+        self.finished = {}
+
+    def _expire(self):
+        # Async job results are only removed once they are older than JOB_TTL
+        now = time.time()
+        for request_id, finished_at in list(self.finished.items()):
+            if now - finished_at < JOB_TTL:
+                break
+            del self.finished[request_id]
+            self.pending_requests.pop(request_id, None)
+
+    async def start(self):
+        pass
+
+    async def put(self, job):
+        self._expire()
+        self.pending_requests[job.request_id] = asyncio.get_running_loop().create_future()
+        self.sizes[job.priority] += 1
+        await self.request_queue.put((job.priority, next(self.sequence), job))
+
+    async def get(self):
+        _, _, job = await self.request_queue.get()
+        self.sizes[job.priority] -= 1
+        return job
+
+    async def ack(self, job):
+        pass
+
+    async def qsize(self, priority=None):
+        if priority is None:
+            return self.request_queue.qsize()
+        return self.sizes[priority]
+
+    async def set_result(self, request_id, result):
+        future = self.pending_requests.get(request_id)
+        if future and not future.done():
+            future.set_result(result)
+            self.finished[request_id] = time.time()
+
+    async def wait_result(self, request_id, timeout):
+        """Wait for the result dict of request_id and remove it. Raises asyncio.TimeoutError."""
+        future = self.pending_requests.get(request_id)
+        if future is None:
+            raise KeyError(f"Unknown request {request_id}")
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            self.pending_requests.pop(request_id, None)
+            self.finished.pop(request_id, None)
+
+    async def get_result(self, request_id, timeout=0):
+        """
+        Return the result dict of request_id without removing it, waiting up to timeout
+        seconds for it. Returns None if it is not ready yet, raises KeyError if unknown.
+        """
+        self._expire()
+        future = self.pending_requests.get(request_id)
+        if future is None:
+            raise KeyError(f"Unknown request {request_id}")
+        if future.done():
+            return future.result()
+        if timeout <= 0:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def get_results(self, request_ids):
+        """
+        Non-blocking lookup of many results at once. Returns {request_id: result dict or None
+        if not ready}; unknown or expired request ids map to an error result.
+        """
+        self._expire()
+        results = {}
+        for request_id in request_ids:
+            future = self.pending_requests.get(request_id)
+            if future is None:
+                results[request_id] = {'error': 'Job expired'}
+            else:
+                results[request_id] = future.result() if future.done() else None
+        return results
+
+    async def close(self):
+        pass
+
+
+class RedisQueueBackend:
+    """Queue shared by all dispatcher replicas through Redis."""
+
+    def __init__(self, url=REDIS_URL, prefix=REDIS_KEY_PREFIX, replica_id=REPLICA_ID, client=None):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("QUEUE_BACKEND=redis requires the 'redis' package") from e
+        # client: an existing redis.asyncio client (e.g. fakeredis when testing) instead of url
+        self.redis = client or redis.from_url(url)
+        self.queue_key = f"{prefix}:queue"
+        self.batch_queue_key = f"{prefix}:batch_queue"
+        self.replicas_key = f"{prefix}:replicas"
+        self.prefix = prefix
+        self.replica_id = replica_id
+        self.processing_key = self._processing_key(replica_id)
+        self.tasks = []
+        self.running = False
+
+    def _queue_key(self, priority):
+        return self.batch_queue_key if priority == PRIORITY_BATCH else self.queue_key
+
+    def _processing_key(self, replica_id):
+        return f"{self.prefix}:processing:{replica_id}"
+
+    def _heartbeat_key(self, replica_id):
+        return f"{self.prefix}:heartbeat:{replica_id}"
+
+    def _image_key(self, request_id):
+        return f"{self.prefix}:image:{request_id}"
+
+    def _result_key(self, request_id):
+        return f"{self.prefix}:result:{request_id}"
+
+    def _job_key(self, request_id):
+        return f"{self.prefix}:job:{request_id}"
+
+    async def put(self, job):
+        # The image is stored next to the queue entry so the list only carries small JSON.
+        # Neither expires while the job is queued: the image is deleted on ack, the job key
+        # expires JOB_TTL after the result is stored.
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._job_key(job.request_id), 1)
+            pipe.set(self._image_key(job.request_id), job.image_bytes)
+            pipe.lpush(self._queue_key(job.priority), json.dumps(job.meta()))
+            await pipe.execute()
+
+    async def start(self):
+        await self.redis.set(self._heartbeat_key(self.replica_id), 1, ex=HEARTBEAT_TTL)
+        await self.redis.sadd(self.replicas_key, self.replica_id)
+        # Jobs this replica held before a container restart
+        await self._requeue(self.replica_id)
+        self.running = True
+        self.tasks = [asyncio.create_task(self._heartbeat()), asyncio.create_task(self._reaper())]
+
+    async def _heartbeat(self):
+        while self.running:
+            try:
+                await self.redis.set(self._heartbeat_key(self.replica_id), 1, ex=HEARTBEAT_TTL)
+                await self.redis.sadd(self.replicas_key, self.replica_id)
+            except Exception as e:
+                print(f"Error refreshing queue heartbeat: {e}")
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def _reaper(self):
+        """Put the jobs of replicas whose heartbeat expired back on the queue."""
+        while self.running:
+            await asyncio.sleep(REAP_INTERVAL)
+            try:
+                for replica_id in await self.redis.smembers(self.replicas_key):
+                    replica_id = replica_id.decode()
+                    if replica_id == self.replica_id or await self.redis.exists(self._heartbeat_key(replica_id)):
+                        continue
+                    requeued = await self._requeue(replica_id)
+                    await self.redis.srem(self.replicas_key, replica_id)
+                    if requeued:
+                        print(f"Requeued {requeued} jobs of dead dispatcher replica {replica_id}")
+            except Exception as e:
+                print(f"Error reaping queue replicas: {e}")
+
+    async def _requeue(self, replica_id):
+        # The oldest job is read and moved in one optimistic transaction (WATCH), so concurrent
+        # reapers never requeue a job twice or onto the other priority's queue. The jobs go to
+        # the consuming end of their queue as they have been waiting the longest.
+        from redis.exceptions import WatchError
+
+        processing_key = self._processing_key(replica_id)
+        count = 0
+        while True:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(processing_key)
+                    raw = await pipe.lindex(processing_key, -1)
+                    if raw is None:
+                        return count
+                    target = self._queue_key(json.loads(raw).get('priority', PRIORITY_INTERACTIVE))
+                    pipe.multi()
+                    pipe.rpop(processing_key)
+                    pipe.rpush(target, raw)
+                    await pipe.execute()
+                    count += 1
+                except WatchError:
+                    # Another reaper moved a job first, look again
+                    continue
+
+    async def _take(self):
+        """Move the next job to the processing list, interactive requests first."""
+        while True:
+            raw = await self.redis.lmove(self.queue_key, self.processing_key, 'RIGHT', 'LEFT')
+            if raw is None:
+                raw = await self.redis.lmove(self.batch_queue_key, self.processing_key, 'RIGHT', 'LEFT')
+            if raw is None:
+                # Block on the interactive queue only, batch jobs are picked up on the next round
+                raw = await self.redis.blmove(self.queue_key, self.processing_key, BATCH_POLL_INTERVAL, 'RIGHT', 'LEFT')
+            if raw is not None:
+                return raw
+
+    async def get(self):
+        while True:
+            raw = await self._take()
+            meta = json.loads(raw)
+            image_bytes = await self.redis.get(self._image_key(meta['request_id']))
+            if image_bytes is None:
+                # Already acknowledged, e.g. a job requeued after its replica finished it late
+                await self.redis.lrem(self.processing_key, 1, raw)
+                continue
+            job = Job(meta['request_id'], image_bytes, meta['content_type'], meta['enqueued_at'],
+                      meta.get('priority', PRIORITY_INTERACTIVE), meta.get('deadline'))
+            job.raw = raw
+            return job
+
+    async def ack(self, job):
+        """Remove a finished job from this replica's processing list."""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrem(self.processing_key, 1, job.raw)
+            pipe.delete(self._image_key(job.request_id))
+            await pipe.execute()
+
+    async def qsize(self, priority=None):
+        if priority is not None:
+            return await self.redis.llen(self._queue_key(priority))
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.llen(self.queue_key)
+            pipe.llen(self.batch_queue_key)
+            return sum(await pipe.execute())
+
+    async def set_result(self, request_id, result):
+        key = self._result_key(request_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, json.dumps(result))
+            pipe.expire(key, JOB_TTL)
+            pipe.expire(self._job_key(request_id), JOB_TTL)
+            await pipe.execute()
+
+    async def wait_result(self, request_id, timeout):
+        """Wait for the result dict of request_id. Raises asyncio.TimeoutError."""
+        key = self._result_key(request_id)
+        item = await self.redis.blpop(key, timeout=timeout)
+        if item is None:
+            raise asyncio.TimeoutError()
+        await self.redis.delete(key, self._job_key(request_id))
+        return json.loads(item[1])
+
+    async def get_result(self, request_id, timeout=0):
+        """
+        Return the result dict of request_id without removing it, waiting up to timeout
+        seconds for it. Returns None if it is not ready yet, raises KeyError if unknown.
+        """
+        key = self._result_key(request_id)
+        item = await self.redis.lindex(key, 0)
+        if item is None:
+            if not await self.redis.exists(self._job_key(request_id)):
+                raise KeyError(f"Unknown request {request_id}")
+            if timeout > 0:
+                # Moving the only element of the list back onto itself reads it without removing it
+                item = await self.redis.blmove(key, key, timeout, 'LEFT', 'RIGHT')
+        if item is None:
+            return None
+        return json.loads(item)
+
+    async def get_results(self, request_ids):
+        """
+        Non-blocking lookup of many results at once, in one round trip. Returns {request_id:
+        result dict or None if not ready}; unknown or expired request ids map to an error result.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for request_id in request_ids:
+                pipe.lindex(self._result_key(request_id), 0)
+                pipe.exists(self._job_key(request_id))
+            replies = await pipe.execute()
+        results = {}
+        for index, request_id in enumerate(request_ids):
+            item, known = replies[2 * index], replies[2 * index + 1]
+            if item is not None:
+                results[request_id] = json.loads(item)
+            elif known:
+                results[request_id] = None
+            else:
+                results[request_id] = {'error': 'Job expired'}
+        return results
+
+    async def close(self):
+        # The flag stops the loops even if a cancellation is swallowed inside a Redis call
+        self.running = False
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.redis.aclose()
+
+
+def create_backend(name=QUEUE_BACKEND):
+    if name == 'local':
+        return LocalQueueBackend()
+    if name == 'redis':
+        return RedisQueueBackend()
+    raise ValueError(f"Unknown queue backend '{name}'")
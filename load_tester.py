@@ -1,11 +1,14 @@
 import os
 import random
 import re
+import sys
 from typing import Tuple
 from aiohttp import FormData, ClientTimeout
 from barazmoon import BarAzmoon
 import asyncio
 
+from analyse_workload import load_workload, split_workload
+
 
 class ImageLoadTester(BarAzmoon):
     def __init__(self, *, workload, endpoint, image_dir, http_method="post", **kwargs):
@@ -128,28 +131,10 @@ class ImageLoadTester(BarAzmoon):
 # Example usage
 if __name__ == "__main__":
     # Define your load pattern - gradual ramp up
-    experiment_workload = []
-    negative_workload = []
-    stress_workload = []
-
-    with open('workload.txt', 'r') as f:
-        workload_pattern = f.read().split(' ')
-
-        count = 0
-        neg_count = 0
-        stress_count = 0
-        for item in workload_pattern:
-            item = int(item)
-            
-            if item < 20:
-                negative_workload.append(item)
-                neg_count += item
-            else:
-                stress_workload.append(item)
-                stress_count += item
-            
-            experiment_workload.append(item)
-            count += item
+    # Any trace produced by `python analyse_workload.py generate` can be passed as first argument
+    workload_file = sys.argv[1] if len(sys.argv) > 1 else 'workload.txt'
+    experiment_workload = load_workload(workload_file).tolist()
+    negative_workload, stress_workload = (w.tolist() for w in split_workload(experiment_workload))
     # list(map(lambda r: int(r / 2), negative_workload))[:]
     # Initialize and run the tester
     tester = ImageLoadTester(
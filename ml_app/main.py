@@ -8,12 +8,13 @@ import threading
 from prometheus_client import Counter, Gauge, Histogram
 from prometheus_client.exposition import start_http_server
 
-from fastapi import FastAPI, UploadFile, Request
-from resnet_inference import ModelInference
+from typing import Optional
+from fastapi import FastAPI, UploadFile, Request, Form
+from model_cascade import ModelCascade
 from PIL import Image
 
-# Object of ModelInference class
-model_inference = ModelInference()
+# Model variants (fp32, int8, low_res) and the policy choosing between them
+model_cascade = ModelCascade()
 app = FastAPI()
 start_http_server(9001)
 
@@ -22,6 +23,12 @@ REQUEST_COUNT = Counter('ml_app_requests_total', 'Total HTTP requests', ['method
 CPU_USAGE = Gauge('ml_app_cpu_usage_percent', 'CPU usage percentage')
 MEMORY_USAGE = Gauge('ml_app_memory_usage_percent', 'Memory usage percentage')
 RESPONSE_TIME = Histogram('ml_app_response_time_seconds', 'Request response time in seconds', ['endpoint'])
+VARIANT_REQUESTS = Counter('ml_app_variant_requests_total', 'Requests served per model variant', ['variant'])
+VARIANT_LATENCY = Histogram('ml_app_variant_inference_seconds', 'Inference latency per model variant in seconds', ['variant'],
+                            buckets=(.025, .05, .075, .1, .15, .2, .3, .4, .5, .75, 1.0, 2.5))
+VARIANT_CONFIDENCE = Histogram('ml_app_variant_confidence_percent', 'Top-1 confidence per model variant', ['variant'],
+                               buckets=(10, 20, 30, 40, 50, 60, 70, 80, 90, 100))
+VARIANT_ACCURACY = Gauge('ml_app_variant_top1_accuracy_percent', 'Published ImageNet top-1 accuracy per model variant', ['variant'])
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -44,6 +51,10 @@ def update_system_metrics():
 
 @app.on_event('startup')
 def startup():
+    model_cascade.warm_up()
+    for variant in model_cascade.variants:
+        if variant.accuracy is not None:
+            VARIANT_ACCURACY.labels(variant=variant.name).set(variant.accuracy)
     threading.Thread(target=update_system_metrics, daemon=True).start()
     logger.info("ML app metrics initiated")
 
@@ -69,15 +80,23 @@ async def home():
     return {'message': 'This is the ML-APP'}
 
 @app.post("/predict")
-async def predict(image: UploadFile):
+async def predict(image: UploadFile,
+                  queue_size: Optional[int] = Form(None),
+                  deadline: Optional[float] = Form(None),
+                  variant: Optional[str] = Form(None)):
     """
     This is a post request async function for model inferencing.
+
+    queue_size (dispatcher queue depth) and deadline (seconds left until the SLO is missed)
+    let the model cascade pick a faster variant under load; variant forces one by name.
     """
     try:
         contents = await image.read()
         image = Image.open(io.BytesIO(contents))
-        preprocessed_image = model_inference.transform_image(image)
-        prediction = model_inference.predict(preprocessed_image)
-        return {'prediction': prediction}
+        prediction, selected, latency = model_cascade.predict(image, queue_size, deadline, variant)
+        VARIANT_REQUESTS.labels(variant=selected.name).inc()
+        VARIANT_LATENCY.labels(variant=selected.name).observe(latency)
+        VARIANT_CONFIDENCE.labels(variant=selected.name).observe(float(prediction.rsplit(':', 1)[1].strip(' %')))
+        return {'prediction': prediction, 'variant': selected.name}
     except Exception as e:
-        return {'Error': e}
\ No newline at end of file
+        return {'Error': e}
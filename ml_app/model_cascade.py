@@ -0,0 +1,153 @@
+"""
+Load-adaptive model degradation (model cascade) for the ML app.
+
+The app hosts several variants of ResNet18, ordered from the most accurate to the fastest:
+    fp32     - the full FP32 ResNet18 at 224x224 (the original model)
+    int8     - the INT8 quantized ResNet18 at 224x224
+    low_res  - the INT8 quantized ResNet18 at a lower input resolution
+
+For every request the policy picks a variant from the dispatcher's queue depth and the
+request's remaining deadline. During spikes, before new replicas are ready, this trades a
+little accuracy for staying under the 0.5 s SLO instead of timing out.
+"""
+
+import math
+import os
+import time
+
+from PIL import Image
+
+
+# Comma separated queue sizes at which the cascade drops one more variant, e.g. "20,50"
+# means fp32 below 20 queued requests, int8 from 20 and low_res from 50.
+QUEUE_THRESHOLDS = [int(q) for q in os.getenv('CASCADE_QUEUE_THRESHOLDS', '20,50').split(',') if q.strip()]
+LOW_RES_RESOLUTION = int(os.getenv('CASCADE_LOW_RES_RESOLUTION', '160'))
+# Smoothing factor of the per-variant latency estimate
+LATENCY_ALPHA = 0.2
+# A variant is only measured while it is picked, so after a spike a skipped variant's
+# estimate decays back to its warm-up baseline with this time constant (in seconds)
+LATENCY_DECAY_SECONDS = float(os.getenv('CASCADE_LATENCY_DECAY_SECONDS', '30'))
+# Timed warm-up runs per variant, after one untimed run that pays the one-time startup cost
+WARM_UP_RUNS = 3
+CASCADE_ENABLED = os.getenv('CASCADE_ENABLED', 'true').lower() == 'true'
+
+
+class ModelVariant:
+    def __init__(self, name, inference, accuracy=None):
+        self.name = name
+        self.inference = inference
+        # ImageNet top-1 accuracy of the variant in percent (None if unknown)
+        self.accuracy = accuracy
+        # Exponentially weighted moving average of the inference latency in seconds
+        self.latency = None
+        # Latency measured at warm-up, what the estimate decays back to
+        self.baseline = None
+        self.last_observed = None
+
+    def observe_latency(self, seconds):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency = LATENCY_ALPHA * seconds + (1 - LATENCY_ALPHA) * self.estimate()
+        self.last_observed = time.monotonic()
+
+    def estimate(self, now=None):
+        """Latency estimate in seconds, decayed towards the baseline since the last observation."""
+        if self.latency is None or self.baseline is None or self.last_observed is None:
+            return self.latency
+        now = time.monotonic() if now is None else now
+        weight = math.exp(-(now - self.last_observed) / LATENCY_DECAY_SECONDS)
+        return self.baseline + (self.latency - self.baseline) * weight
+
+    def predict(self, image):
+        tensor = self.inference.transform_image(image)
+        return self.inference.predict(tensor)
+
+
+class CascadePolicy:
+    def __init__(self, queue_thresholds=None):
+        self.queue_thresholds = sorted(QUEUE_THRESHOLDS if queue_thresholds is None else queue_thresholds)
+
+    def select(self, variants, queue_size=None, deadline=None):
+        """
+        Pick the index of the variant to use for one request.
+
+        1. Every queue threshold reached by queue_size skips the next most accurate variant.
+        2. From there, take the first (most accurate) variant whose latency estimate fits
+           into the remaining deadline; if none fits, take the fastest one.
+        """
+        start = 0
+        if queue_size is not None:
+            start = sum(1 for threshold in self.queue_thresholds if queue_size >= threshold)
+        start = min(start, len(variants) - 1)
+
+        if deadline is None:
+            return start
+        for index in range(start, len(variants)):
+            latency = variants[index].estimate()
+            if latency is None or latency <= deadline:
+                return index
+        return len(variants) - 1
+
+
+class ModelCascade:
+    def __init__(self, variants=None, policy=None, enabled=CASCADE_ENABLED):
+        if variants is None:
+            variants = default_variants()
+        self.variants = variants
+        self.policy = policy or CascadePolicy()
+        self.enabled = enabled
+
+    def get_variant(self, name):
+        for variant in self.variants:
+            if variant.name == name:
+                return variant
+        raise ValueError(f"Unknown model variant '{name}'")
+
+    def select(self, queue_size=None, deadline=None, variant=None):
+        if variant is not None:
+            return self.get_variant(variant)
+        if not self.enabled:
+            return self.variants[0]
+        return self.variants[self.policy.select(self.variants, queue_size, deadline)]
+
+    def warm_up(self):
+        """Run every variant a few times so the policy starts with real latency estimates."""
+        image = Image.new('RGB', (256, 256))
+        for variant in self.variants:
+            # The first call includes one-time startup cost and is not measured
+            variant.predict(image)
+            for _ in range(WARM_UP_RUNS):
+                self.run(variant, image)
+            variant.baseline = variant.latency
+
+    def run(self, variant, image):
+        """Classify image with variant. Returns (prediction, latency in seconds)."""
+        start_time = time.perf_counter()
+        prediction = variant.predict(image)
+        latency = time.perf_counter() - start_time
+        variant.observe_latency(latency)
+        return prediction, latency
+
+    def predict(self, image, queue_size=None, deadline=None, variant=None):
+        """Returns (prediction, variant, latency in seconds)."""
+        selected = self.select(queue_size, deadline, variant)
+        prediction, latency = self.run(selected, image)
+        return prediction, selected, latency
+
+
+def top1_accuracy(weights):
+    return weights.meta.get("_metrics", {}).get("ImageNet-1K", {}).get("acc@1")
+
+
+def default_variants():
+    # Imported here so the policy can be used (and tested) without torch and the model weights
+    from resnet_inference import ModelInference, MODEL, WEIGHTS, QUANTIZED_WEIGHTS, load_quantized_model
+
+    quantized_model = load_quantized_model()
+    return [
+        ModelVariant('fp32', ModelInference(MODEL, WEIGHTS), top1_accuracy(WEIGHTS)),
+        ModelVariant('int8', ModelInference(quantized_model, QUANTIZED_WEIGHTS), top1_accuracy(QUANTIZED_WEIGHTS)),
+        # No published accuracy for the reduced input resolution
+        ModelVariant('low_res', ModelInference(quantized_model, QUANTIZED_WEIGHTS, LOW_RES_RESOLUTION)),
+    ]
@@ -4,38 +4,50 @@ The API allows us to use pre-trained models like ResNet-X [X - represents Layers
 For the cloud computing project we are using ResNet18 for image classification.
 """
 
+import torch
 from torchvision.io import decode_image
 from torchvision.models import resnet18, ResNet18_Weights
+from torchvision.models.quantization import resnet18 as quantized_resnet18, ResNet18_QuantizedWeights
 from torchvision.transforms import transforms
 
 
 # Global constant variables for the project
 WEIGHTS = ResNet18_Weights.DEFAULT
 MODEL = resnet18(weights=WEIGHTS)
+RESOLUTION = 224
+
+# INT8 ResNet18 (fbgemm backend, runs on CPU only)
+QUANTIZED_WEIGHTS = ResNet18_QuantizedWeights.DEFAULT
+
+
+def load_quantized_model():
+    return quantized_resnet18(weights=QUANTIZED_WEIGHTS, quantize=True)
 
 
 class ModelInference:
-    def __init__(self):
+    def __init__(self, model=MODEL, weights=WEIGHTS, resolution=RESOLUTION):
         self.image = None
-        self.weights = WEIGHTS
-        self.model = MODEL
-    
-    def transform_image(self, image):
-        self.image = image
-        transform = transforms.Compose([
-            transforms.Resize((224, 224)),
+        self.weights = weights
+        self.model = model
+        self.resolution = resolution
+        self.transform = transforms.Compose([
+            transforms.Resize((resolution, resolution)),
             transforms.ToTensor()
         ])
-        tensor = transform(image).unsqueeze(0)  # Returns FloatTensor in [0, 1]
+        self.model.eval()
+
+    def transform_image(self, image):
+        self.image = image
+        tensor = self.transform(image).unsqueeze(0)  # Returns FloatTensor in [0, 1]
         return tensor
 
     def predict(self, image_tensor):
         preprocessed_image = image_tensor
 
-        self.model.eval()
         # Use the model and print the predicted category
-        prediction = self.model(preprocessed_image).squeeze(0).softmax(0)
+        with torch.no_grad():
+            prediction = self.model(preprocessed_image).squeeze(0).softmax(0)
         class_id = prediction.argmax().item()
         score = prediction[class_id].item()
         category_name = self.weights.meta["categories"][class_id]
-        return f"{category_name}: {100 * score:.1f}%"
\ No newline at end of file
+        return f"{category_name}: {100 * score:.1f}%"
@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The services are plain script directories, not packages
+for path in (ROOT, os.path.join(ROOT, 'dispatcher'), os.path.join(ROOT, 'ml_app')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,94 @@
+import sys
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import analyse_workload as aw
+
+
+def test_chunk_boundaries_do_not_split_numbers(tmp_path):
+    values = [12, 345, 6789, 0, 10, 2, 77777]
+    path = tmp_path / 'trace.txt'
+    path.write_text('12 345\t6789\n0 10  2\n77777')
+    for chunk_size in range(1, len(path.read_text()) + 2):
+        assert aw.load_workload(path, chunk_size).tolist() == values
+
+
+def test_load_empty_trace(tmp_path):
+    path = tmp_path / 'trace.txt'
+    path.write_text('  \n')
+    assert aw.load_workload(path).size == 0
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = tmp_path / 'trace.txt'
+    aw.save_workload(path, [1, 2, 3])
+    assert path.read_text() == '1 2 3'
+    assert aw.load_workload(path).tolist() == [1, 2, 3]
+
+
+def test_ramp_slopes():
+    ramp = 3 * np.arange(30) + 5
+    slopes = aw.ramp_slopes(ramp, window=10)
+    assert slopes.size == 21
+    assert np.allclose(slopes, 3)
+    assert np.allclose(aw.ramp_slopes(ramp[::-1], window=10), -3)
+    assert aw.ramp_slopes(ramp, window=31).size == 0
+
+
+def test_dominant_period_of_seasonal_trace():
+    t = np.arange(600)
+    workload = 50 + 40 * np.sin(2 * np.pi * t / 20)
+    period, value = aw.dominant_period(aw.autocorrelation(workload))
+    assert period == 20
+    assert value > 0.9
+
+
+def test_no_period_for_trend_or_constant_trace():
+    rng = np.random.default_rng(0)
+    trend = np.arange(600) + rng.normal(0, 3, 600)
+    assert aw.dominant_period(aw.autocorrelation(trend))[0] is None
+    assert aw.dominant_period(aw.autocorrelation(np.full(100, 7))) == (None, 0.0)
+
+
+def test_scale_workload():
+    assert aw.scale_workload([1, 2, 3], 2).tolist() == [2, 4, 6]
+    assert aw.scale_workload([1, 2, 3], -1).tolist() == [0, 0, 0]
+
+
+def test_compress_workload_keeps_requests():
+    assert aw.compress_workload([1, 2, 3, 4, 5], 2).tolist() == [3, 7, 5]
+    assert aw.compress_workload([1, 2, 3], 1).tolist() == [1, 2, 3]
+
+
+def test_inject_bursts():
+    workload = np.zeros(100, dtype=np.int64)
+    bursty = aw.inject_bursts(workload, 1, magnitude=3, duration=10, rng=np.random.default_rng(0))
+    assert np.count_nonzero(bursty) == 10
+    assert bursty.max() <= 3
+    # Bursts only ever add load
+    base = np.full(100, 10)
+    bursty = aw.inject_bursts(base, 3, rng=np.random.default_rng(0))
+    assert (bursty >= base).all() and bursty.max() > 10
+    assert aw.inject_bursts(base, 0).tolist() == base.tolist()
+
+
+def test_generate_workload():
+    workload = np.arange(10)
+    generated = aw.generate_workload(workload, scale=2, compress=2)
+    assert generated.tolist() == aw.compress_workload(aw.scale_workload(workload, 2), 2).tolist()
+    assert generated.sum() == 2 * workload.sum()
+    first = aw.generate_workload(workload, bursts=2, noise=True, seed=1)
+    second = aw.generate_workload(workload, bursts=2, noise=True, seed=1)
+    assert first.tolist() == second.tolist()
+
+
+def test_stats_of_empty_trace_is_a_usage_error(tmp_path, monkeypatch, capsys):
+    path = tmp_path / 'trace.txt'
+    path.write_text('')
+    monkeypatch.setattr(sys, 'argv', ['analyse_workload.py', 'stats', str(path)])
+    with pytest.raises(SystemExit) as exc:
+        aw.main()
+    assert exc.value.code == 2
+    assert 'Workload trace is empty' in capsys.readouterr().err
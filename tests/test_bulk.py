@@ -0,0 +1,85 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+pytest.importorskip('fastapi')
+pytest.importorskip('PIL')
+
+from dispatcher import BulkArchiveError, BulkLimitError, extract_images
+
+LIMITS = dict(max_images=10, max_image_bytes=100, max_total_bytes=250)
+
+
+def make_zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files:
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def make_tar(files, mode='w:gz'):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as archive:
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+def test_extracts_images_from_archives():
+    files = [('a.jpg', b'a' * 10), ('dir/b.PNG', b'b' * 20), ('notes.txt', b'skipped')]
+    assert extract_images('images.zip', make_zip(files), **LIMITS) == files[:2]
+    assert extract_images('images.tar.gz', make_tar(files), **LIMITS) == files[:2]
+    assert extract_images('c.jpg', io.BytesIO(b'c' * 10), **LIMITS) == [('c.jpg', b'c' * 10)]
+
+
+@pytest.mark.parametrize('make_archive', [make_zip, make_tar])
+def test_limits(make_archive):
+    with pytest.raises(BulkLimitError, match='Too many images'):
+        extract_images('x', make_archive([(f'{i}.jpg', b'x') for i in range(11)]), **LIMITS)
+    with pytest.raises(BulkLimitError, match='a.jpg is larger'):
+        extract_images('x', make_archive([('a.jpg', b'x' * 101)]), **LIMITS)
+    with pytest.raises(BulkLimitError, match='in total'):
+        extract_images('x', make_archive([(f'{i}.jpg', b'x' * 90) for i in range(3)]), **LIMITS)
+
+
+def test_zip_bomb_is_rejected_from_the_index():
+    archive = make_zip([('bomb.jpg', b'\0' * 10 ** 7)])
+    assert len(archive.getvalue()) < 20000
+    with pytest.raises(BulkLimitError):
+        extract_images('bomb.zip', archive, **LIMITS)
+
+
+def test_tar_stops_reading_at_first_member_over_the_limits(monkeypatch):
+    headers = []
+    next_member = tarfile.TarFile.next
+
+    def counting_next(self):
+        member = next_member(self)
+        headers.append(member)
+        return member
+
+    monkeypatch.setattr(tarfile.TarFile, 'next', counting_next)
+    archive = make_tar([('a.jpg', b'x' * 101)] + [(f'{i}.jpg', b'x') for i in range(5)])
+    with pytest.raises(BulkLimitError):
+        extract_images('x.tar.gz', archive, **LIMITS)
+    # Only the first header was read (is_tarfile and tarfile.open read it too)
+    assert {member.name for member in headers} == {'a.jpg'}
+
+
+def test_corrupt_archives():
+    data = bytearray(make_zip([('a.jpg', b'a' * 50)]).getvalue())
+    # Flip a byte of the compressed member data: bad CRC or broken deflate stream
+    data[40] ^= 0xFF
+    with pytest.raises(BulkArchiveError):
+        extract_images('bad.zip', io.BytesIO(bytes(data)), **LIMITS)
+
+    data = make_tar([(f'{i}.jpg', bytes(range(50))) for i in range(4)]).getvalue()
+    with pytest.raises(BulkArchiveError):
+        extract_images('truncated.tar.gz', io.BytesIO(data[:len(data) // 2]), **LIMITS)
@@ -0,0 +1,122 @@
+import math
+import time
+
+import pytest
+
+pytest.importorskip('PIL')
+
+import model_cascade
+from model_cascade import CascadePolicy, ModelCascade, ModelVariant, LATENCY_DECAY_SECONDS, WARM_UP_RUNS
+
+
+class StubInference:
+    """Stands in for ModelInference, optionally slow on its first call like a cold model."""
+
+    def __init__(self, first_call_seconds=0):
+        self.calls = 0
+        self.first_call_seconds = first_call_seconds
+
+    def transform_image(self, image):
+        return image
+
+    def predict(self, tensor):
+        self.calls += 1
+        if self.calls == 1:
+            time.sleep(self.first_call_seconds)
+        return 'tabby', 90.0
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(model_cascade.time, 'monotonic', clock)
+    return clock
+
+
+def make_variants(*latencies):
+    variants = []
+    for name, latency in zip(('fp32', 'int8', 'low_res'), latencies):
+        variant = ModelVariant(name, StubInference())
+        if latency is not None:
+            variant.observe_latency(latency)
+            variant.baseline = latency
+        variants.append(variant)
+    return variants
+
+
+def test_queue_thresholds_skip_variants():
+    policy = CascadePolicy([50, 20])
+    variants = make_variants(None, None, None)
+    assert [policy.select(variants, q) for q in (None, 0, 19, 20, 49, 50, 1000)] == [0, 0, 0, 1, 1, 2, 2]
+
+
+def test_deadline_picks_most_accurate_variant_that_fits(clock):
+    policy = CascadePolicy([])
+    variants = make_variants(0.4, 0.2, 0.1)
+    assert policy.select(variants, deadline=0.5) == 0
+    assert policy.select(variants, deadline=0.3) == 1
+    # Nothing fits: the fastest variant
+    assert policy.select(variants, deadline=0.05) == 2
+    # The queue threshold is applied before the deadline
+    assert CascadePolicy([10]).select(variants, queue_size=10, deadline=0.5) == 1
+
+
+def test_unmeasured_variant_fits_any_deadline():
+    assert CascadePolicy([]).select(make_variants(None, 0.1, 0.1), deadline=0.01) == 0
+
+
+def test_latency_estimate_decays_to_baseline(clock):
+    variant = make_variants(0.1)[0]
+    variant.observe_latency(1.1)
+    spiked = 0.2 * 1.1 + 0.8 * 0.1
+    assert variant.estimate() == pytest.approx(spiked)
+    clock.now += LATENCY_DECAY_SECONDS
+    assert variant.estimate() == pytest.approx(0.1 + (spiked - 0.1) / math.e)
+    clock.now += 10 * LATENCY_DECAY_SECONDS
+    assert variant.estimate() == pytest.approx(0.1, abs=1e-4)
+
+
+def test_skipped_variant_recovers_after_spike(clock):
+    variants = make_variants(0.3, 0.1, 0.05)
+    cascade = ModelCascade(variants, CascadePolicy([]))
+
+    # Spike: fp32 gets slow and the cascade moves to int8
+    for _ in range(5):
+        variants[0].observe_latency(1.0)
+    assert cascade.select(deadline=0.5) is variants[1]
+
+    # fp32 is no longer picked, so it is not measured, but its estimate recovers anyway
+    for _ in range(10):
+        clock.now += LATENCY_DECAY_SECONDS / 2
+        variants[1].observe_latency(0.1)
+    assert cascade.select(deadline=0.5) is variants[0]
+
+
+def test_warm_up_excludes_first_call():
+    variants = [ModelVariant('fp32', StubInference(first_call_seconds=0.2)),
+                ModelVariant('int8', StubInference(first_call_seconds=0.2))]
+    ModelCascade(variants, CascadePolicy([])).warm_up()
+    for variant in variants:
+        assert variant.inference.calls == 1 + WARM_UP_RUNS
+        assert variant.baseline == variant.latency
+        assert variant.latency < 0.1
+
+
+def test_cascade_select():
+    variants = make_variants(0.3, 0.1, 0.05)
+    cascade = ModelCascade(variants, CascadePolicy([1]))
+    assert cascade.select(queue_size=5) is variants[1]
+    assert cascade.select(queue_size=5, variant='low_res') is variants[2]
+    with pytest.raises(ValueError):
+        cascade.select(variant='fp16')
+    assert ModelCascade(variants, CascadePolicy([1]), enabled=False).select(queue_size=5) is variants[0]
+    prediction, variant, latency = cascade.predict(None, queue_size=0)
+    assert prediction == ('tabby', 90.0) and variant is variants[0] and latency >= 0
@@ -0,0 +1,193 @@
+import asyncio
+import json
+
+import pytest
+
+import queue_backend
+from queue_backend import Job, LocalQueueBackend, RedisQueueBackend, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+
+
+@pytest.fixture
+def redis_server():
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('redis')
+    return fakeredis.FakeServer()
+
+
+def redis_backend(server, replica_id='replica-a'):
+    import fakeredis
+    return RedisQueueBackend(prefix='test', replica_id=replica_id, client=fakeredis.FakeAsyncRedis(server=server))
+
+
+@pytest.fixture(params=['local', 'redis'])
+def make_backend(request):
+    """Backends of one test share one (fake) Redis server."""
+    if request.param == 'local':
+        return lambda replica_id=None: LocalQueueBackend()
+    server = request.getfixturevalue('redis_server')
+    return lambda replica_id='replica-a': redis_backend(server, replica_id)
+
+
+def test_put_get_ack(make_backend):
+    async def run():
+        backend = make_backend()
+        await backend.put(Job('r1', b'image', 'image/png', deadline=0.5))
+        assert await backend.qsize() == 1
+        job = await backend.get()
+        assert (job.request_id, job.image_bytes, job.content_type, job.deadline) == ('r1', b'image', 'image/png', 0.5)
+        assert await backend.qsize() == 0
+        await backend.set_result('r1', {'prediction': 'tabby'})
+        await backend.ack(job)
+        assert await backend.wait_result('r1', timeout=1) == {'prediction': 'tabby'}
+        await backend.close()
+    asyncio.run(run())
+
+
+def test_interactive_before_batch(make_backend):
+    async def run():
+        backend = make_backend()
+        await backend.put(Job('batch-1', b'1', priority=PRIORITY_BATCH))
+        await backend.put(Job('batch-2', b'2', priority=PRIORITY_BATCH))
+        await backend.put(Job('interactive-1', b'3'))
+        await backend.put(Job('interactive-2', b'4'))
+        assert await backend.qsize(PRIORITY_INTERACTIVE) == 2
+        assert await backend.qsize(PRIORITY_BATCH) == 2
+        order = []
+        for _ in range(4):
+            job = await backend.get()
+            await backend.ack(job)
+            order.append(job.request_id)
+        assert order == ['interactive-1', 'interactive-2', 'batch-1', 'batch-2']
+        await backend.close()
+    asyncio.run(run())
+
+
+def test_results_can_be_polled(make_backend):
+    async def run():
+        backend = make_backend()
+        await backend.put(Job('r1', b'1', priority=PRIORITY_BATCH))
+        assert await backend.get_result('r1') is None
+        assert await backend.get_results(['r1', 'unknown']) == {'r1': None, 'unknown': {'error': 'Job expired'}}
+        with pytest.raises(KeyError):
+            await backend.get_result('unknown')
+        await backend.set_result('r1', {'prediction': 'tabby'})
+        # Polling does not consume the result
+        assert await backend.get_result('r1', timeout=1) == {'prediction': 'tabby'}
+        assert await backend.get_results(['r1']) == {'r1': {'prediction': 'tabby'}}
+        await backend.close()
+    asyncio.run(run())
+
+
+def test_unacked_job_stays_in_processing_list(redis_server):
+    async def run():
+        backend = redis_backend(redis_server)
+        await backend.put(Job('r1', b'1'))
+        job = await backend.get()
+        assert await backend.redis.lrange(backend.processing_key, 0, -1) == [job.raw]
+        await backend.ack(job)
+        assert await backend.redis.llen(backend.processing_key) == 0
+        assert not await backend.redis.exists(backend._image_key('r1'))
+        await backend.close()
+    asyncio.run(run())
+
+
+def test_dead_replica_jobs_are_requeued(redis_server, monkeypatch):
+    monkeypatch.setattr(queue_backend, 'REAP_INTERVAL', 0.01)
+
+    async def run():
+        dead = redis_backend(redis_server, 'replica-dead')
+        await dead.start()
+        await dead.put(Job('interactive', b'1'))
+        await dead.put(Job('batch', b'2', priority=PRIORITY_BATCH))
+        await dead.get()
+        await dead.get()
+        # The replica dies mid-job: no ack, no more heartbeats
+        await dead.close()
+        await dead.redis.delete(dead._heartbeat_key('replica-dead'))
+
+        alive = redis_backend(redis_server, 'replica-alive')
+        await alive.start()
+        await asyncio.sleep(0.1)
+        assert await alive.redis.llen(dead.processing_key) == 0
+        assert not await alive.redis.sismember(alive.replicas_key, 'replica-dead')
+        assert await alive.qsize(PRIORITY_INTERACTIVE) == 1
+        assert await alive.qsize(PRIORITY_BATCH) == 1
+        assert (await alive.get()).request_id == 'interactive'
+        assert (await alive.get()).request_id == 'batch'
+        await alive.close()
+    asyncio.run(run())
+
+
+def test_live_replica_jobs_are_not_requeued(redis_server, monkeypatch):
+    monkeypatch.setattr(queue_backend, 'REAP_INTERVAL', 0.01)
+
+    async def run():
+        busy = redis_backend(redis_server, 'replica-busy')
+        await busy.start()
+        await busy.put(Job('r1', b'1'))
+        await busy.get()
+        other = redis_backend(redis_server, 'replica-other')
+        await other.start()
+        await asyncio.sleep(0.1)
+        assert await other.redis.llen(busy.processing_key) == 1
+        assert await other.qsize() == 0
+        await busy.close()
+        await other.close()
+    asyncio.run(run())
+
+
+def test_restarted_replica_requeues_its_own_jobs(redis_server):
+    async def run():
+        before = redis_backend(redis_server, 'replica-a')
+        await before.put(Job('r1', b'1'))
+        await before.get()
+        # Container restart: same pod name, processing list left over
+        after = redis_backend(redis_server, 'replica-a')
+        await after.start()
+        job = await after.get()
+        assert job.request_id == 'r1'
+        assert await after.redis.llen(after.processing_key) == 1
+        await after.close()
+    asyncio.run(run())
+
+
+def test_concurrent_reapers_keep_priorities(redis_server):
+    async def run():
+        dead = redis_backend(redis_server, 'replica-dead')
+        jobs = [Job(f'r{i}', b'1', priority=PRIORITY_BATCH if i % 2 else PRIORITY_INTERACTIVE) for i in range(20)]
+        for job in jobs:
+            await dead.redis.lpush(dead.processing_key, json.dumps(job.meta()))
+        reapers = [redis_backend(redis_server, f'reaper-{i}') for i in range(3)]
+        counts = await asyncio.gather(*(reaper._requeue('replica-dead') for reaper in reapers))
+        assert sum(counts) == 20
+        interactive = [json.loads(raw)['request_id'] for raw in await dead.redis.lrange(dead.queue_key, 0, -1)]
+        batch = [json.loads(raw)['request_id'] for raw in await dead.redis.lrange(dead.batch_queue_key, 0, -1)]
+        assert sorted(interactive) == sorted(job.request_id for job in jobs if job.priority == PRIORITY_INTERACTIVE)
+        assert sorted(batch) == sorted(job.request_id for job in jobs if job.priority == PRIORITY_BATCH)
+    asyncio.run(run())
+
+
+def test_queued_jobs_do_not_expire(make_backend, monkeypatch):
+    monkeypatch.setattr(queue_backend, 'JOB_TTL', 1)
+
+    async def run():
+        backend = make_backend()
+        await backend.put(Job('r1', b'1', priority=PRIORITY_BATCH))
+        await backend.put(Job('r2', b'2', priority=PRIORITY_BATCH))
+        # Waiting behind interactive traffic for longer than JOB_TTL
+        await asyncio.sleep(1.2)
+        await backend.put(Job('r3', b'3'))
+        assert await backend.get_result('r1') is None
+        assert await backend.get_results(['r1', 'r2']) == {'r1': None, 'r2': None}
+        assert [(await backend.get()).request_id for _ in range(3)] == ['r3', 'r1', 'r2']
+
+        # Results are kept for JOB_TTL after they are stored
+        await backend.set_result('r1', {'prediction': 'tabby'})
+        await asyncio.sleep(0.5)
+        assert await backend.get_result('r1') == {'prediction': 'tabby'}
+        await asyncio.sleep(0.7)
+        with pytest.raises(KeyError):
+            await backend.get_result('r1')
+        assert await backend.get_result('r2') is None
+        await backend.close()
+    asyncio.run(run())
@@ -0,0 +1,271 @@
+"""
+Local check of scale to zero, without a cluster: the autoscaler runs against a fake Kubernetes
+API and the dispatcher against a fake ML app that only starts once the deployment is scaled up.
+
+    pip install -r requirements.txt pytest
+    python -m pytest tests
+"""
+
+import asyncio
+import importlib.util
+import io
+import os
+import socket
+import time
+from types import SimpleNamespace
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+uvicorn = pytest.importorskip('uvicorn')
+pytest.importorskip('aiohttp')
+pytest.importorskip('kubernetes')
+pytest.importorskip('fastapi')
+Image = pytest.importorskip('PIL.Image')
+from fastapi import FastAPI, Form, UploadFile
+from prometheus_client import REGISTRY
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+ML_PORT = free_port()
+WAKE_PORT = free_port()
+
+
+def load_module(name, path, env):
+    """
+    Both services have a main.py, so they are loaded under their own names. Their settings are
+    read from the environment at import time, the environment is restored afterwards.
+    """
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        for key, value in env.items():
+            monkeypatch.setenv(key, value)
+        spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='module')
+def autoscaler():
+    return load_module('autoscaler_main', 'custom_autoscaler/main.py', {'SCALE_TO_ZERO': 'true'})
+
+
+@pytest.fixture(scope='module')
+def dispatcher_main():
+    return load_module('dispatcher_main', 'dispatcher/main.py', {
+        'SCALE_TO_ZERO': 'true',
+        'QUEUE_BACKEND': 'local',
+        'ML_SERVICE_URL': f'http://127.0.0.1:{ML_PORT}',
+        'AUTOSCALER_URL': f'http://127.0.0.1:{WAKE_PORT}',
+        'METRICS_PORT': str(free_port()),
+    })
+
+
+class FakeAppsV1:
+    """The parts of kubernetes.client.AppsV1Api the autoscaler uses."""
+
+    def __init__(self, replicas, on_scale=None):
+        self.replicas = replicas
+        self.on_scale = on_scale
+
+    def read_namespaced_deployment(self, name, namespace):
+        return SimpleNamespace(spec=SimpleNamespace(replicas=self.replicas))
+
+    def patch_namespaced_deployment_scale(self, name, namespace, body):
+        self.replicas = body['spec']['replicas']
+        if self.on_scale:
+            self.on_scale(self.replicas)
+
+
+def pod(ready):
+    conditions = [SimpleNamespace(type='Ready', status='True')] if ready else None
+    return SimpleNamespace(status=SimpleNamespace(phase='Running' if ready else 'Pending', conditions=conditions))
+
+
+class FakeCoreV1:
+    """The parts of kubernetes.client.CoreV1Api the autoscaler uses."""
+
+    def __init__(self, pods=()):
+        self.pods = list(pods)
+
+    def list_namespaced_pod(self, namespace, label_selector):
+        return SimpleNamespace(items=self.pods)
+
+
+class FakeMLApp:
+    """Stands in for the ML app's replicas: accepts connections only while scaled up."""
+
+    def __init__(self, port, on_start=None):
+        app = FastAPI()
+
+        @app.get('/')
+        async def home():
+            return {'message': 'fake ML app'}
+
+        @app.post('/predict')
+        async def predict(image: UploadFile, queue_size: int = Form(None), deadline: float = Form(None)):
+            return {'prediction': 'tabby: 90.00%'}
+
+        self.server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning', lifespan='off'))
+        self.task = None
+        self.on_start = on_start
+
+    def on_scale(self, replicas):
+        if replicas and self.task is None:
+            if self.on_start:
+                self.on_start()
+            self.task = asyncio.get_running_loop().create_task(self.server.serve())
+
+    async def stop(self):
+        if self.task:
+            self.server.should_exit = True
+            await self.task
+
+
+def fake_metrics(autoscaler, monkeypatch, qsize, last_request, inflight=0):
+    metrics = {'dispatcher_queue_size': qsize, 'dispatcher_inflight_requests': inflight,
+               'dispatcher_last_request_timestamp_seconds': last_request}
+
+    async def get_metric(query):
+        return next(value for name, value in metrics.items() if name in query)
+    monkeypatch.setattr(autoscaler, 'get_metric', get_metric)
+
+
+def test_idle_scales_to_zero_and_wake_scales_to_one(autoscaler, monkeypatch):
+    apps_v1 = FakeAppsV1(replicas=1)
+    monkeypatch.setattr(autoscaler, 'last_scale_time', 0)
+    idle_since = time.time() - autoscaler.SCALE_TO_ZERO_IDLE_SECONDS
+
+    # Recently active: stays at MIN_REPLICAS
+    fake_metrics(autoscaler, monkeypatch, qsize=0, last_request=time.time())
+    asyncio.run(autoscaler.main(apps_v1, FakeCoreV1()))
+    assert apps_v1.replicas == 1
+
+    # Requests held by the dispatcher's workers are not idle, even with an empty queue
+    fake_metrics(autoscaler, monkeypatch, qsize=0, last_request=idle_since, inflight=2)
+    asyncio.run(autoscaler.main(apps_v1, FakeCoreV1()))
+    assert apps_v1.replicas == 1
+
+    # Idle for longer than SCALE_TO_ZERO_IDLE_SECONDS with an empty queue
+    fake_metrics(autoscaler, monkeypatch, qsize=0, last_request=idle_since)
+    asyncio.run(autoscaler.main(apps_v1, FakeCoreV1()))
+    assert apps_v1.replicas == 0
+
+    async def wake():
+        runner = await autoscaler.start_wake_server(apps_v1, WAKE_PORT)
+        try:
+            async with httpx.AsyncClient() as client:
+                responses = [(await client.post(f'http://127.0.0.1:{WAKE_PORT}/wake')).json() for _ in range(2)]
+        finally:
+            await runner.cleanup()
+        return responses
+
+    # The second signal finds the ML app already scaling up
+    assert asyncio.run(wake()) == [{'replicas': 1}, {'replicas': None}]
+    assert apps_v1.replicas == 1
+
+
+def test_burst_from_zero_is_sized_by_queue(autoscaler, monkeypatch):
+    apps_v1 = FakeAppsV1(replicas=0)
+    # Scaling to zero just happened, so the regular scaling is in its cooldown
+    scaled_to_zero_at = time.time()
+    monkeypatch.setattr(autoscaler, 'last_scale_time', scaled_to_zero_at)
+    fake_metrics(autoscaler, monkeypatch, qsize=2 * autoscaler.DESIRED_QSIZE, last_request=time.time(),
+                 inflight=0.4 * autoscaler.DESIRED_QSIZE)
+    asyncio.run(autoscaler.main(apps_v1, FakeCoreV1()))
+    assert apps_v1.replicas == 3
+    # Scaling up from zero does not start a new cooldown
+    assert autoscaler.last_scale_time == scaled_to_zero_at
+
+
+def test_scaling_waits_for_pending_pods(autoscaler, monkeypatch):
+    apps_v1 = FakeAppsV1(replicas=2)
+    monkeypatch.setattr(autoscaler, 'last_scale_time', 0)
+    fake_metrics(autoscaler, monkeypatch, qsize=4 * autoscaler.DESIRED_QSIZE, last_request=time.time())
+
+    asyncio.run(autoscaler.main(apps_v1, FakeCoreV1([pod(ready=True), pod(ready=False)])))
+    assert apps_v1.replicas == 2
+
+    asyncio.run(autoscaler.main(apps_v1, FakeCoreV1([pod(ready=True), pod(ready=True)])))
+    assert apps_v1.replicas == autoscaler.MAX_REPLICAS
+
+
+def cold_start_count():
+    return REGISTRY.get_sample_value('dispatcher_cold_start_wait_seconds_count') or 0
+
+
+def send_during_cold_start(autoscaler, dispatcher_main, monkeypatch, on_start=None):
+    image = io.BytesIO()
+    Image.new('RGB', (32, 32)).save(image, format='JPEG')
+
+    async def run():
+        # The dispatcher's queue and events belong to the event loop of one test
+        ml_backend_ready = asyncio.Event()
+        ml_backend_ready.set()
+        monkeypatch.setattr(dispatcher_main, 'ml_backend_ready', ml_backend_ready)
+        monkeypatch.setattr(dispatcher_main, 'cold_start_task', None)
+        monkeypatch.setattr(dispatcher_main, 'dispatcher', dispatcher_main.Dispatcher())
+        ml_app = FakeMLApp(ML_PORT, on_start)
+        apps_v1 = FakeAppsV1(replicas=0, on_scale=ml_app.on_scale)
+        wake_server = await autoscaler.start_wake_server(apps_v1, WAKE_PORT)
+        await dispatcher_main.startup_event()
+        try:
+            transport = httpx.ASGITransport(app=dispatcher_main.app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://dispatcher', timeout=30) as client:
+                response = await client.post('/add_to_queue', files={'image': ('image.jpg', image.getvalue(), 'image/jpeg')})
+        finally:
+            await dispatcher_main.shutdown_event()
+            await wake_server.cleanup()
+            await ml_app.stop()
+        return response.json(), apps_v1.replicas
+
+    return asyncio.run(run())
+
+
+def test_dispatcher_buffers_requests_during_cold_start(autoscaler, dispatcher_main, monkeypatch):
+    cold_starts = cold_start_count()
+    sent_at = time.time()
+    seen = {}
+
+    def on_start():
+        # The request is still buffered when the autoscaler is woken
+        seen['last_request'] = REGISTRY.get_sample_value('dispatcher_last_request_timestamp_seconds')
+        seen['inflight'] = REGISTRY.get_sample_value('dispatcher_inflight_requests')
+
+    result, replicas = send_during_cold_start(autoscaler, dispatcher_main, monkeypatch, on_start)
+    assert result['prediction'] == 'tabby: 90.00%'
+    assert replicas == 1
+    assert seen['last_request'] >= sent_at
+    assert seen['inflight'] == 1
+    assert REGISTRY.get_sample_value('dispatcher_inflight_requests') == 0
+    assert cold_start_count() == cold_starts + 1
+    assert REGISTRY.get_sample_value('dispatcher_cold_start_wait_seconds_sum') > 0
+    assert REGISTRY.get_sample_value('dispatcher_ml_backend_available') == 1
+
+
+def test_cold_start_survives_queue_backend_errors(autoscaler, dispatcher_main, monkeypatch):
+    signal_autoscaler = dispatcher_main.signal_autoscaler
+    failures = []
+
+    async def failing_signal_autoscaler():
+        # e.g. dispatcher.qsize() failing with QUEUE_BACKEND=redis
+        if not failures:
+            failures.append(1)
+            raise ConnectionError("queue backend unavailable")
+        await signal_autoscaler()
+
+    monkeypatch.setattr(dispatcher_main, 'signal_autoscaler', failing_signal_autoscaler)
+    monkeypatch.setattr(dispatcher_main, 'WAKE_SIGNAL_INTERVAL', 0)
+    cold_starts = cold_start_count()
+    result, replicas = send_during_cold_start(autoscaler, dispatcher_main, monkeypatch)
+    assert failures
+    assert result['prediction'] == 'tabby: 90.00%'
+    assert replicas == 1
+    assert cold_start_count() == cold_starts + 1